@@ -10,20 +10,66 @@ MEHRAAB FERDOUSE - s393148
 
 '''
 
+import argparse
+import codecs
+import glob
+import json
+import mmap
 import os
+import string
+import struct
+import time
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import accumulate
 
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional, without it the text is encrypted and decrypted one character at a time
+    np = None
 
 
-# A dictionary to store keys in the format x# where x is the encrypted character and # is the nth time it appears, and the value which is the original character
-encryption_map = {}  
-# A dictionary that stores the encrypted character as the key, and the nth time it appears as the value (as multiple characters can have the same encrypted character)
-encrypted_counts = {}  
+
+# A dictionary that only stores the encrypted characters that more than one original character can be encrypted to.
+# The key is the encrypted character and the value is a pair made of a string of the possible original characters
+# and a compact array of bytes, where the nth byte is the position in that string of the original character for the nth time it appears.
+# If only one of the possible original characters appears in the text, the string only holds that character and the array stays empty
+encryption_map = {}
 # A dictionary that stores the character to be decrypted as the key, and the nth time it appears as the value
+# (only characters found in encryption_map need to be counted)
 decrypted_counts = {}
 
 # A global variable that stores the path to raw_text.txt
 raw_path = None
 
+# The number of characters read, encrypted or decrypted and written at a time,
+# so that the memory used stays the same no matter how large the file is
+BLOCK_SIZE = 1 << 20
+
+# Every shifted or colliding character has an ASCII value below this, so it is the size of the lookup arrays used by the NumPy kernels
+LOOKUP_SIZE = 256
+
+# The number of bytes of raw_text.txt given to each worker process when encrypting in parallel,
+# files larger than this are split into shards and encrypted using encrypt_parallel
+SHARD_SIZE = 16 << 20
+
+# The layout of encryption_key.bin, which stores the shift values and encryption_map so decryption can be run as a separate job.
+# The header holds the file signature, the format version, the two shift values and the number of entries.
+# Each entry holds the encrypted character, its possible original characters and where its positions are stored in the file,
+# and the positions of every entry follow the entries as raw bytes so they can be read straight from a memory map
+KEY_MAGIC = b'A2Q1KEY\0'
+KEY_VERSION = 1
+KEY_HEADER = struct.Struct('<8sHBBI')
+KEY_ENTRY = struct.Struct('<IB7sQQ')
+
+# The version of session.json, which stores the state of an appendable encryption session
+SESSION_VERSION = 1
+
 
 
 def find_raw_text():
@@ -78,67 +124,596 @@ def shift_input():
 
 
 
-def encrypt_char(char, shift1, shift2):
+def shift_char(char, shift1, shift2):
     """
-    Encrypts a single character using the specified shift values.
-    Encrypted_counts keeps track of how many times each encrypted character has appeared.
-    Encryption_map stores the encrypted characters along with a count suffix as the key and their corresponding original characters as the value.
+    Calculates the encrypted character for a single character using the specified shift values
     """
     
     # Calculates the encrypted character based on the ASCII value and the shift values
     o = ord(char)
     if 'a' <= char <= 'm':        
-        encrypted_char = chr(o + (shift1*shift2))
+        return chr(o + (shift1*shift2))
     elif 'n' <= char <= 'z':      
-        encrypted_char = chr(o - (shift1+shift2))
+        return chr(o - (shift1+shift2))
     elif 'A' <= char <= 'M':      
-        encrypted_char = chr(o - shift1)
+        return chr(o - shift1)
     elif 'N' <= char <= 'Z':      
-        encrypted_char = chr(o + (shift2**2))
+        return chr(o + (shift2**2))
     else:
-        encrypted_char = char
+        return char
+
+
+
+@lru_cache(maxsize=None)
+def collision_table(shift1, shift2):
+    """
+    Finds the encrypted characters that more than one original character can be encrypted to with the specified shift values.
+    Only letters are shifted, so any other encrypted character could also be an original character that was left unchanged.
+    Returns a dictionary with the encrypted character as the key and a sorted string of the possible original characters as the value
+    """
+    
+    # Groups the letters by the character they are encrypted to
+    originals = {}
+    for char in string.ascii_letters:
+        encrypted_char = shift_char(char, shift1, shift2)
+        originals[encrypted_char] = originals.get(encrypted_char, '') + char
+
+    collisions = {}
+    for encrypted_char, chars in originals.items():
+        # An encrypted character that is not a letter can also come from the same character left unchanged
+        if encrypted_char not in string.ascii_letters:
+            chars += encrypted_char
+        # Only encrypted characters with more than one possible original character are kept
+        if len(chars) > 1:
+            collisions[encrypted_char] = ''.join(sorted(chars))
+
+    # Returns the dictionary of colliding encrypted characters
+    return collisions
+
+
+
+@lru_cache(maxsize=None)
+def decryption_table(shift1, shift2):
+    """
+    Builds a table that reverses the shift for every encrypted letter that only one original character can be encrypted to.
+    The table maps the ASCII value of the encrypted character to the original character, so it can also be used with str.translate
+    """
+    
+    collisions = collision_table(shift1, shift2)
+    table = {}
+    for char in string.ascii_letters:
+        encrypted_char = shift_char(char, shift1, shift2)
+        # Colliding encrypted characters are left out as they have to be decrypted using encryption_map
+        if encrypted_char not in collisions:
+            table[ord(encrypted_char)] = char
+
+    # Returns the decryption table
+    return table
+
+
+
+@lru_cache(maxsize=None)
+def encryption_table(shift1, shift2):
+    """
+    Builds a table that maps the ASCII value of every letter to its encrypted character, so it can be used with str.translate
+    """
+    
+    return {ord(char): shift_char(char, shift1, shift2) for char in string.ascii_letters}
+
+
+
+def translate_text(text, table):
+    """
+    Translates text using a table that maps ASCII values below LOOKUP_SIZE to single characters below LOOKUP_SIZE.
+    Text that only has characters below 256 is translated as Latin-1 bytes, which is much faster than str.translate
+    """
+    
+    try:
+        text_bytes = text.encode('latin-1')
+    except UnicodeEncodeError:
+        # The text has other characters, which are never shifted, so str.translate is used instead
+        return text.translate(table)
+    byte_table = bytes(ord(table.get(code, chr(code))) for code in range(LOOKUP_SIZE))
+    return text_bytes.translate(byte_table).decode('latin-1')
+
+
+
+def split_collisions(shift1, shift2, alphabet):
+    """
+    Uses the set of characters that appear in the text to work out which colliding encrypted characters actually need to be recorded.
+    Returns a dictionary of the encrypted characters where more than one of the possible original characters appears in the text,
+    and a dictionary of the encrypted characters where only one does, with that original character as the value
+    """
+    
+    tracked = {}
+    resolved = {}
+    for encrypted_char, originals in collision_table(shift1, shift2).items():
+        present = [char for char in originals if char in alphabet]
+        if len(present) > 1:
+            tracked[encrypted_char] = originals
+        elif len(present) == 1:
+            resolved[encrypted_char] = present[0]
+
+    # Returns the two dictionaries
+    return tracked, resolved
+
+
+
+def text_alphabet(path, block_size=BLOCK_SIZE):
+    """
+    Reads a file one block at a time and returns the set of characters that appear in it
+    """
+    
+    alphabet = set()
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            alphabet.update(block)
+    return alphabet
+
+
+
+def start_encryption(shift1, shift2, block_size=BLOCK_SIZE):
+    """
+    Starts a new encryption of raw_text.txt by emptying encryption_map and decrypted_counts.
+    Encrypted characters that only one character in the text can be encrypted to are added to encryption_map straight away,
+    and the dictionary of the colliding encrypted characters that still have to be recorded one occurrence at a time is returned
+    """
+    
+    encryption_map.clear()
+    decrypted_counts.clear()
+
+    tracked, resolved = split_collisions(shift1, shift2, text_alphabet(raw_path, block_size))
+    for encrypted_char, original in resolved.items():
+        encryption_map[encrypted_char] = (original, array('B'))
+
+    # Returns the colliding encrypted characters that have to be recorded
+    return tracked
+
 
-    # Assigns a value to count for the amount of times a character is encrypted to a specific encrypted character
-    count = encrypted_counts.get(encrypted_char, 0) + 1
-    # Adds the encrypted character into the encrypted_counts dictionary and the amount of times it has appeared as the value
-    encrypted_counts[encrypted_char] = count
 
-    # Creates a key for encryption_map in the format x# where x is the encrypted character and # is the nth time it appears
-    key = f"{encrypted_char}{count}"
-    # Adds the key created as the key in the dictionary and the original character as the value
-    encryption_map[key] = char
+def encrypt_char(char, shift1, shift2, collisions=None):
+    """
+    Encrypts a single character using the specified shift values.
+    If more than one original character can be encrypted to the same encrypted character,
+    encryption_map records which of them this occurrence came from so it can be decrypted later.
+    collisions is the dictionary of colliding encrypted characters to record, which defaults to all of them for the shift values
+    """
+    
+    # Calculates the encrypted character based on the ASCII value and the shift values
+    encrypted_char = shift_char(char, shift1, shift2)
+
+    # Only encrypted characters that collide need to be recorded in encryption_map
+    if collisions is None:
+        collisions = collision_table(shift1, shift2)
+    originals = collisions.get(encrypted_char)
+    if originals is not None:
+        if encrypted_char not in encryption_map:
+            encryption_map[encrypted_char] = (originals, array('B'))
+        # Adds the position of the original character in the string of possible original characters,
+        # so the nth byte of the array belongs to the nth time the encrypted character appears
+        encryption_map[encrypted_char][1].append(originals.index(char))
 
     # Returns the encrypted character
     return encrypted_char
 
 
 
-def encrypt(shift1, shift2, output_folder):
+def text_to_codes(text):
+    """
+    Converts a string into a NumPy array of uint32 code points
+    """
+    
+    return np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+
+
+
+def codes_to_text(codes):
+    """
+    Converts a NumPy array of uint32 code points back into a string
+    """
+    
+    return codes.astype('<u4', copy=False).tobytes().decode('utf-32-le')
+
+
+
+def encrypt_codes(codes, shift1, shift2):
+    """
+    Encrypts a whole array of uint32 code points at once.
+    Applies the same four rules as shift_char using masks, and leaves every other character unchanged
+    """
+    
+    # Masks for each of the four ranges, worked out from the original code points
+    lower_first = (codes >= ord('a')) & (codes <= ord('m'))
+    lower_second = (codes >= ord('n')) & (codes <= ord('z'))
+    upper_first = (codes >= ord('A')) & (codes <= ord('M'))
+    upper_second = (codes >= ord('N')) & (codes <= ord('Z'))
+
+    # Shifts the characters in each range, characters outside all four ranges are passed through
+    encrypted = codes.astype(np.uint32, copy=True)
+    encrypted[lower_first] += shift1*shift2
+    encrypted[lower_second] -= shift1+shift2
+    encrypted[upper_first] -= shift1
+    encrypted[upper_second] += shift2**2
+
+    # Returns the encrypted code points
+    return encrypted
+
+
+
+@lru_cache(maxsize=None)
+def decryption_lookup(shift1, shift2):
+    """
+    Turns the decryption table into a NumPy lookup array indexed by the encrypted code point
+    """
+    
+    lookup = np.arange(LOOKUP_SIZE, dtype=np.uint32)
+    for encrypted_code, char in decryption_table(shift1, shift2).items():
+        lookup[encrypted_code] = ord(char)
+    return lookup
+
+
+
+def decrypt_codes(codes, shift1, shift2):
+    """
+    Decrypts a whole array of uint32 code points at once for the characters that do not collide.
+    Colliding characters are left unchanged, so this is the full decryption when the text has no collisions
+    """
+    
+    # Code points outside the lookup array were never shifted, so only the ones inside it are looked up
+    decrypted = codes.astype(np.uint32, copy=True)
+    inside = codes < LOOKUP_SIZE
+    decrypted[inside] = decryption_lookup(shift1, shift2)[codes[inside]]
+
+    # Returns the decrypted code points
+    return decrypted
+
+
+
+@lru_cache(maxsize=None)
+def collision_lookup(shift1, shift2):
+    """
+    Builds the lookup arrays the NumPy kernels use to find colliding characters.
+    Returns the list of colliding encrypted characters, an array with the entry number (starting at 1) of each
+    colliding encrypted code point or 0 if it does not collide, and an array with the position of each possible
+    original character in its string of originals
+    """
+    
+    collisions = collision_table(shift1, shift2)
+    entry_numbers = np.zeros(LOOKUP_SIZE, dtype=np.uint8)
+    original_positions = np.zeros(LOOKUP_SIZE, dtype=np.uint8)
+    for number, (encrypted_char, originals) in enumerate(collisions.items(), start=1):
+        entry_numbers[ord(encrypted_char)] = number
+        # A letter is only ever encrypted to one character, so each original character belongs to a single entry
+        for position, char in enumerate(originals):
+            original_positions[ord(char)] = position
+
+    # Returns the lookup arrays
+    return list(collisions), entry_numbers, original_positions
+
+
+
+def group_collisions(codes, shift1, shift2):
+    """
+    Finds where the colliding encrypted characters appear in an array of encrypted code points.
+    Yields each colliding encrypted character that appears together with its positions, in the order they appear in the text
+    """
+    
+    encrypted_chars, entry_numbers, _ = collision_lookup(shift1, shift2)
+
+    # Looks up the entry number of every code point, anything outside the lookup array does not collide
+    numbers = entry_numbers[np.minimum(codes, LOOKUP_SIZE - 1)]
+    found = np.flatnonzero(numbers)
+    if found.size == 0:
+        return
+
+    # A stable sort groups the positions by character while keeping each group in the order it appears in the text
+    found = found[np.argsort(numbers[found], kind='stable')]
+    sorted_numbers = numbers[found]
+    starts = np.flatnonzero(np.diff(sorted_numbers)) + 1
+    for group in np.split(found, starts):
+        yield encrypted_chars[numbers[group[0]] - 1], group
+
+
+
+def encrypt_block(block, shift1, shift2, collisions=None):
+    """
+    Encrypts a block of text and returns the encrypted block as a single string so it can be written in one go.
+    collisions is the dictionary of colliding encrypted characters to record, which defaults to all of them for the shift values.
+    When there is nothing to record str.translate is used, otherwise the NumPy kernel when NumPy is installed
+    or the encrypt_char function one character at a time
+    """
+    
+    if collisions is None:
+        collisions = collision_table(shift1, shift2)
+    if not collisions:
+        # Nothing in the text collides, so the block is simply translated and nothing is kept for each character
+        return translate_text(block, encryption_table(shift1, shift2))
+
+    if np is None:
+        # encrypt_char keeps updating encryption_map, so the occurrence counts carry on from the previous block
+        return ''.join([encrypt_char(char, shift1, shift2, collisions) for char in block])
+
+    codes = text_to_codes(block)
+    encrypted = encrypt_codes(codes, shift1, shift2)
+
+    # Records which original character each colliding encrypted character came from, in the order they appear,
+    # by adding to the end of its array in encryption_map so the counts carry on from the previous block
+    original_positions = collision_lookup(shift1, shift2)[2]
+    for encrypted_char, group in group_collisions(encrypted, shift1, shift2):
+        if encrypted_char not in collisions:
+            continue
+        if encrypted_char not in encryption_map:
+            encryption_map[encrypted_char] = (collisions[encrypted_char], array('B'))
+        encryption_map[encrypted_char][1].frombytes(original_positions[codes[group]].tobytes())
+
+    # Returns the encrypted block
+    return codes_to_text(encrypted)
+
+
+
+def decrypt_block(block, encryption_map, shift1, shift2):
     """
-    Reads raw_text.txt, uses the encrypt_char function to encrypt each character
-    and writes the encrypted text to encrypted_text.txt in the same folder as raw_text.txt
+    Decrypts a block of encrypted text using the shift values and the encryption_map
+    and returns the decrypted block as a single string so it can be written in one go
+    """
+    
+    if np is not None:
+        codes = text_to_codes(block)
+        decrypted = decrypt_codes(codes, shift1, shift2)
+
+        # Colliding characters are decrypted from encryption_map, continuing from the count reached in the previous block
+        for char, group in group_collisions(codes, shift1, shift2):
+            entry = encryption_map.get(char)
+            if entry is None:
+                continue
+            originals, positions = entry
+            if len(originals) == 1:
+                # Only one possible original character appeared in the text, so no counting is needed
+                decrypted[group] = ord(originals)
+                continue
+            count = decrypted_counts.get(char, 0)
+            decrypted_counts[char] = count + group.size
+            chosen = np.frombuffer(positions, dtype=np.uint8, count=group.size, offset=count)
+            decrypted[group] = np.array([ord(original) for original in originals], dtype=np.uint32)[chosen]
+
+        # Returns the decrypted block
+        return codes_to_text(decrypted)
+
+    table = decryption_table(shift1, shift2)
+    decrypted_chars = []
+    for char in block:
+        entry = encryption_map.get(char)
+        if entry is None:
+            # Characters that do not collide are decrypted using the table, or left unchanged if they were never shifted
+            decrypted_chars.append(table.get(ord(char), char))
+            continue
+        originals, positions = entry
+        if len(originals) == 1:
+            # Only one possible original character appeared in the text, so no counting is needed
+            decrypted_chars.append(originals)
+            continue
+
+        # Assigns a value to count for the amount of times this character has been decrypted so far,
+        # which carries on from the previous block as decrypted_counts is a global dictionary
+        count = decrypted_counts.get(char, 0)
+        # Adds the character to be decrypted into the decrypted_counts dictionary and the amount of times it has appeared as the value
+        decrypted_counts[char] = count + 1
+        
+        # Looks up which of the possible original characters this occurrence came from
+        decrypted_chars.append(originals[positions[count]])
+
+    # Returns the decrypted block
+    return ''.join(decrypted_chars)
+
+
+
+def encrypt(shift1, shift2, output_folder, block_size=BLOCK_SIZE):
+    """
+    Reads raw_text.txt one block at a time, uses the encrypt_block function to encrypt each block
+    and writes the encrypted text to encrypted_text.txt in the same folder as raw_text.txt.
+    Each call starts a new encryption_map
     """
     
     # Path for the encrypted file is set in the same folder as raw_text.txt
     encrypted_file_path = os.path.join(output_folder, 'encrypted_text.txt')
     
-    # raw_text.txt is opened for reading, and encrypted_text.txt is created for writing
-    with open(raw_path, 'r', encoding='utf-8') as file:
-        with open(encrypted_file_path, 'w', encoding='utf-8') as encrypted_file:
-            raw_text = file.read()
-            # For each character in the raw text, encrypt it using the encrypt_char function
-            # and write the encrypted characters to the encrypted file to form the encrypted text
-            for char in raw_text:
-                encrypted_file.write(encrypt_char(char, shift1, shift2))
+    # Works out which colliding encrypted characters have to be recorded for the characters in raw_text.txt
+    collisions = start_encryption(shift1, shift2, block_size)
+    
+    # raw_text.txt is opened for reading, and encrypted_text.txt is created for writing.
+    # newline='' keeps line endings exactly as they are, so the decrypted file can match the raw file byte for byte
+    with open(raw_path, 'r', encoding='utf-8', newline='') as file:
+        with open(encrypted_file_path, 'w', encoding='utf-8', newline='') as encrypted_file:
+            # Reads the raw text block_size characters at a time until the end of the file,
+            # and writes each encrypted block to the encrypted file with a single write
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    break
+                encrypted_file.write(encrypt_block(block, shift1, shift2, collisions))
+    
+    # Saves the shift values and encryption_map so the text can be decrypted later, even by another process
+    write_key(os.path.join(output_folder, 'encryption_key.bin'), shift1, shift2, encryption_map)
     
     # Returns the path to the encrypted file
     return encrypted_file_path
 
 
 
-def decrypt(encryption_map, output_folder):
+def shard_boundaries(path, shard_size):
+    """
+    Splits a file into shards of about shard_size bytes and returns the byte offsets where the shards start and end.
+    Each boundary is moved forward past any UTF-8 continuation bytes so that no character is split between two shards
+    """
+    
+    file_size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as file:
+        offset = shard_size
+        while offset < file_size:
+            file.seek(offset)
+            # Bytes in the form 10xxxxxx continue a character, so the shard has to end after them
+            for byte in file.read(4):
+                if byte & 0xC0 != 0x80:
+                    break
+                offset += 1
+            if offset < file_size:
+                boundaries.append(offset)
+            offset += shard_size
+    boundaries.append(file_size)
+
+    # Returns the list of boundaries, shard n starts at boundaries[n] and ends at boundaries[n + 1]
+    return boundaries
+
+
+
+def encrypt_shard(path, start, end, shift1, shift2, collisions):
     """
-    Reads encrypted_text.txt, uses the encryption_map to decrypt each character
+    Encrypts one shard of a file inside a worker process.
+    Returns the encrypted shard as UTF-8 bytes and a dictionary with each colliding encrypted character as the key
+    and the bytes of original character positions for this shard only as the value
+    """
+    
+    # Reads the shard from the file
+    with open(path, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+
+    # Each worker has its own copy of encryption_map, which is emptied so that it only holds this shard's collisions
+    encryption_map.clear()
+    encrypted_text = encrypt_block(text, shift1, shift2, collisions)
+    positions = {char: entry[1].tobytes() for char, entry in encryption_map.items()}
+    encryption_map.clear()
+
+    # Returns the encrypted shard and its collisions
+    return encrypted_text.encode('utf-8'), positions
+
+
+
+def encrypt_parallel(shift1, shift2, output_folder, workers=None, shard_size=SHARD_SIZE):
+    """
+    Encrypts raw_text.txt the same way as the encrypt function, but splits it into shards that are encrypted in a pool of worker processes.
+    The encrypted shards are written in order, and each shard's collisions are placed into encryption_map at offsets
+    worked out with a prefix sum of the shard counts, so the result is exactly the same as encrypting the file in one go
+    """
+    
+    # Path for the encrypted file is set in the same folder as raw_text.txt
+    encrypted_file_path = os.path.join(output_folder, 'encrypted_text.txt')
+    
+    # Works out which colliding encrypted characters have to be recorded for the characters in raw_text.txt
+    collisions = start_encryption(shift1, shift2)
+    
+    boundaries = shard_boundaries(raw_path, shard_size)
+    shards = list(zip(boundaries, boundaries[1:]))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # A list that stores the collisions of every shard in the order of the shards
+    shard_positions = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        with open(encrypted_file_path, 'wb') as encrypted_file:
+            # Only a couple of shards per worker are in progress at a time, so the memory used stays the same no matter how large the file is
+            pending = deque()
+            for start, end in shards:
+                pending.append(executor.submit(encrypt_shard, raw_path, start, end, shift1, shift2, collisions))
+                if len(pending) >= 2*workers:
+                    encrypted_bytes, positions = pending.popleft().result()
+                    encrypted_file.write(encrypted_bytes)
+                    shard_positions.append(positions)
+            while pending:
+                encrypted_bytes, positions = pending.popleft().result()
+                encrypted_file.write(encrypted_bytes)
+                shard_positions.append(positions)
+
+    # For each colliding encrypted character, a prefix sum of the number of times it appears in each shard
+    # gives the offset where that shard's positions start
+    for char in sorted(set().union(*shard_positions)):
+        if char not in encryption_map:
+            encryption_map[char] = (collisions[char], array('B'))
+        positions = encryption_map[char][1]
+        counts = [len(shard.get(char, b'')) for shard in shard_positions]
+        offsets = list(accumulate(counts, initial=len(positions)))
+
+        # The array is grown once to its final size and each shard is copied into its own slice
+        positions.frombytes(bytes(offsets[-1] - offsets[0]))
+        with memoryview(positions) as view:
+            for shard, offset, count in zip(shard_positions, offsets, counts):
+                if count:
+                    view[offset:offset + count] = shard[char]
+    
+    # Saves the shift values and encryption_map so the text can be decrypted later, even by another process
+    write_key(os.path.join(output_folder, 'encryption_key.bin'), shift1, shift2, encryption_map)
+    
+    # Returns the path to the encrypted file
+    return encrypted_file_path
+
+
+
+def write_key(key_path, shift1, shift2, encryption_map):
+    """
+    Writes the shift values and encryption_map to a binary key file in the KEY_HEADER and KEY_ENTRY layout
+    """
+    
+    chars = sorted(encryption_map)
+    # The positions of the entries start straight after the header and the entries
+    offset = KEY_HEADER.size + KEY_ENTRY.size*len(chars)
+    with open(key_path, 'wb') as key_file:
+        key_file.write(KEY_HEADER.pack(KEY_MAGIC, KEY_VERSION, shift1, shift2, len(chars)))
+        for char in chars:
+            originals, positions = encryption_map[char]
+            # Every possible original character has an ASCII value below LOOKUP_SIZE, so each fits in one byte
+            key_file.write(KEY_ENTRY.pack(ord(char), len(originals), originals.encode('latin-1'), offset, len(positions)))
+            offset += len(positions)
+        for char in chars:
+            key_file.write(encryption_map[char][1])
+
+    # Returns the path to the key file
+    return key_path
+
+
+
+@contextmanager
+def open_key(key_path):
+    """
+    Opens a key file written by write_key using a memory map.
+    Gives back the two shift values and an encryption_map whose arrays of positions are views into the memory map,
+    so the positions are read straight from the file instead of being loaded into memory
+    """
+    
+    with open(key_path, 'rb') as key_file:
+        key_map = mmap.mmap(key_file.fileno(), 0, access=mmap.ACCESS_READ)
+    key_view = memoryview(key_map)
+    views = []
+    try:
+        # Checks that the file is a key file that this version of the program can read
+        magic, version, shift1, shift2, entry_count = KEY_HEADER.unpack_from(key_map, 0)
+        if magic != KEY_MAGIC:
+            raise ValueError(f"{key_path} is not an encryption key file.")
+        if version != KEY_VERSION:
+            raise ValueError(f"{key_path} uses key file version {version}, but only version {KEY_VERSION} is supported.")
+
+        key_encryption_map = {}
+        for number in range(entry_count):
+            code, original_count, originals, offset, count = KEY_ENTRY.unpack_from(key_map, KEY_HEADER.size + KEY_ENTRY.size*number)
+            views.append(key_view[offset:offset + count])
+            key_encryption_map[chr(code)] = (originals[:original_count].decode('latin-1'), views[-1])
+
+        yield shift1, shift2, key_encryption_map
+    finally:
+        # The views have to be released before the memory map can be closed
+        for view in views:
+            view.release()
+        key_view.release()
+        key_map.close()
+
+
+
+def decrypt(encryption_map, shift1, shift2, output_folder, block_size=BLOCK_SIZE):
+    """
+    Reads encrypted_text.txt one block at a time, uses the shift values and the encryption_map to decrypt each block
     and writes the decrypted text to decrypted_text.txt in the same folder as raw_text.txt
     """
     
@@ -146,27 +721,280 @@ def decrypt(encryption_map, output_folder):
     encrypted_file_path = os.path.join(output_folder, 'encrypted_text.txt')
     decrypted_file_path = os.path.join(output_folder, 'decrypted_text.txt')
     
+    # If no encrypted character needs counting, the whole text can be decrypted using str.translate with the decryption table
+    # and the original character of every encrypted character that only had one possible original character in the text
+    table = None
+    if all(len(originals) == 1 for originals, positions in encryption_map.values()):
+        table = dict(decryption_table(shift1, shift2))
+        table.update({ord(char): originals for char, (originals, positions) in encryption_map.items()})
+    
     # encrypted_text.txt is opened for reading, and decrypted_text.txt is created for writing
-    with open(encrypted_file_path, 'r', encoding='utf-8') as encrypted_file:
-        with open(decrypted_file_path, 'w', encoding='utf-8') as decrypted_file:
-            # For each character in the encrypted text, check if it exists in the encryption_map
-            for char in encrypted_file.read():
-                # Assigns a value to count for the amount of times a character is to be decrypted to a specific encrypted character
-                count = decrypted_counts.get(char, 0) + 1
-                # Adds the character to be decrypted into the decrypted_counts dictionary and the amount of times it has appeared as the value
-                # ***IF ENCRYPTION AND DECRYPTION ARE PERFORMED CORRECTLY, decrypted_counts AND encrypted_counts SHOULD BE IDENTICAL***
-                decrypted_counts[char] = count
-                
-                # Creates a key in the format x# where x is the character to be decrypted and # is the nth time it appears
-                key = f"{char}{count}"
-                # Searches for the key inside encryption_map, and if found, writes the corresponding value to the decrypted file
-                decrypted_file.write(encryption_map.get(key, char))
+    with open(encrypted_file_path, 'r', encoding='utf-8', newline='') as encrypted_file:
+        with open(decrypted_file_path, 'w', encoding='utf-8', newline='') as decrypted_file:
+            # Reads the encrypted text block_size characters at a time until the end of the file,
+            # and writes each decrypted block to the decrypted file with a single write
+            while True:
+                block = encrypted_file.read(block_size)
+                if not block:
+                    break
+                if table is not None:
+                    decrypted_file.write(translate_text(block, table))
+                else:
+                    decrypted_file.write(decrypt_block(block, encryption_map, shift1, shift2))
+    
+    # Returns the path to the decrypted file
+    return decrypted_file_path
+
+
+
+def decrypt_with_key(output_folder, key_path=None):
+    """
+    Decrypts encrypted_text.txt using only the key file written by encrypt, so it does not need to run
+    in the same program that encrypted the text
+    """
     
+    if key_path is None:
+        key_path = os.path.join(output_folder, 'encryption_key.bin')
+
+    # The key file describes a whole encrypted file, so the counts start again from the beginning
+    decrypted_counts.clear()
+    with open_key(key_path) as (shift1, shift2, key_encryption_map):
+        decrypted_file_path = decrypt(key_encryption_map, shift1, shift2, output_folder)
+    decrypted_counts.clear()
+
     # Returns the path to the decrypted file
     return decrypted_file_path
 
 
 
+def load_session(output_folder, shift1=None, shift2=None):
+    """
+    Loads session.json from output_folder, or starts a new session if there is none yet.
+    The session stores the shift values, how many bytes of the raw file have been encrypted, how many bytes of the encrypted file
+    have been decrypted, the lengths of encrypted_text.txt and decrypted_text.txt, and for every colliding encrypted character
+    its possible original characters, the number of times it has been encrypted and decrypted and the length of its positions file.
+    The positions themselves are kept in one file per character in session_positions
+    """
+    
+    session_path = os.path.join(output_folder, 'session.json')
+    if not os.path.exists(session_path):
+        if shift1 is None or shift2 is None:
+            raise FileNotFoundError(f"No encryption session was found in {output_folder}.")
+        return {'version': SESSION_VERSION, 'shift1': shift1, 'shift2': shift2,
+                'raw_offset': 0, 'encrypted_offset': 0, 'encrypted_bytes': 0, 'decrypted_bytes': 0, 'entries': {}}
+
+    with open(session_path, 'r', encoding='utf-8') as session_file:
+        session = json.load(session_file)
+    # Checks that the session can be carried on with this version of the program and the same shift values
+    if session.get('version') != SESSION_VERSION:
+        raise ValueError(f"{session_path} uses session version {session.get('version')}, but only version {SESSION_VERSION} is supported.")
+    if shift1 is not None and (session['shift1'], session['shift2']) != (shift1, shift2):
+        raise ValueError(f"{session_path} was encrypted with shift values {session['shift1']} and {session['shift2']}.")
+    return session
+
+
+
+def save_session(output_folder, session):
+    """
+    Saves the session to session.json, replacing the old file in one step so it is never left half written
+    """
+    
+    session_path = os.path.join(output_folder, 'session.json')
+    with open(session_path + '.tmp', 'w', encoding='utf-8') as session_file:
+        json.dump(session, session_file, indent=2)
+    os.replace(session_path + '.tmp', session_path)
+
+
+
+def truncate_file(path, length):
+    """
+    Cuts a file back to length bytes, removing it if length is 0
+    """
+    
+    if length == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    if not os.path.exists(path) or os.path.getsize(path) < length:
+        raise ValueError(f"{path} is shorter than recorded in session.json, so a new session is needed.")
+    with open(path, 'r+b') as file:
+        file.truncate(length)
+
+
+
+def restore_session_files(output_folder, session):
+    """
+    Cuts encrypted_text.txt, decrypted_text.txt and every positions file back to the lengths saved in the session.
+    Data is added to these files block by block but the session is only saved at the end of a run, so this undoes anything
+    written by a run that did not finish. For a new session every length is 0, which removes any old output in the folder
+    """
+    
+    truncate_file(os.path.join(output_folder, 'encrypted_text.txt'), session['encrypted_bytes'])
+    truncate_file(os.path.join(output_folder, 'decrypted_text.txt'), session['decrypted_bytes'])
+
+    # Positions files of characters that are not in the session were written by a run that did not finish
+    positions_folder = os.path.join(output_folder, 'session_positions')
+    os.makedirs(positions_folder, exist_ok=True)
+    for file_name in os.listdir(positions_folder):
+        entry = session['entries'].get(file_name[:-len('.bin')]) if file_name.endswith('.bin') else None
+        truncate_file(os.path.join(positions_folder, file_name), entry['bytes'] if entry else 0)
+
+
+
+def read_new_text(path, offset, block_size):
+    """
+    Reads a UTF-8 file from a byte offset one block at a time.
+    Yields each block of text together with the byte offset reached after it. A character that is only partly written
+    at the end of the file is left for the next run, so the offset always falls between two whole characters
+    """
+    
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        while True:
+            chunk = file.read(block_size)
+            if not chunk:
+                break
+            offset += len(chunk)
+            text = decoder.decode(chunk)
+            if text:
+                # The bytes still held by the decoder belong to a character that is not finished yet
+                yield text, offset - len(decoder.getstate()[0])
+
+
+
+def encrypt_session(shift1, shift2, output_folder, block_size=BLOCK_SIZE):
+    """
+    Encrypts only the part of raw_text.txt that was added since the last run and adds it to the end of encrypted_text.txt,
+    carrying on the occurrence counts saved in session.json. This way a growing log file only costs as much as its new data.
+    Every colliding character is recorded, as characters that have not appeared yet may still be added to the file later
+    """
+    
+    encrypted_file_path = os.path.join(output_folder, 'encrypted_text.txt')
+    positions_folder = os.path.join(output_folder, 'session_positions')
+
+    session = load_session(output_folder, shift1, shift2)
+    restore_session_files(output_folder, session)
+    # Raises an error if the raw file got smaller, since it was not only appended to
+    if os.path.getsize(raw_path) < session['raw_offset']:
+        raise ValueError(f"{raw_path} is smaller than the part already encrypted, so a new session is needed.")
+
+    collisions = collision_table(shift1, shift2)
+    with open(encrypted_file_path, 'ab') as encrypted_file:
+        for block, raw_offset in read_new_text(raw_path, session['raw_offset'], block_size):
+            # encryption_map only holds the positions of the current block, which are then added to the end of each character's file
+            encryption_map.clear()
+            encrypted_file.write(encrypt_block(block, shift1, shift2, collisions).encode('utf-8'))
+            for char, (originals, positions) in encryption_map.items():
+                with open(os.path.join(positions_folder, f"{ord(char)}.bin"), 'ab') as positions_file:
+                    positions_file.write(positions)
+                entry = session['entries'].setdefault(str(ord(char)), {'originals': originals, 'count': 0, 'decrypted': 0, 'bytes': 0})
+                entry['count'] += len(positions)
+                entry['bytes'] += len(positions)*positions.itemsize
+            session['raw_offset'] = raw_offset
+            session['encrypted_bytes'] = encrypted_file.tell()
+    encryption_map.clear()
+
+    # Saves the session once the new text has been encrypted
+    save_session(output_folder, session)
+    
+    # Returns the path to the encrypted file
+    return encrypted_file_path
+
+
+
+def decrypt_session(output_folder, block_size=BLOCK_SIZE):
+    """
+    Decrypts only the part of encrypted_text.txt that was added since the last run and adds it to the end of decrypted_text.txt,
+    carrying on the decrypted counts saved in session.json
+    """
+    
+    encrypted_file_path = os.path.join(output_folder, 'encrypted_text.txt')
+    decrypted_file_path = os.path.join(output_folder, 'decrypted_text.txt')
+    positions_folder = os.path.join(output_folder, 'session_positions')
+    session = load_session(output_folder)
+    restore_session_files(output_folder, session)
+
+    # Each character's positions file is memory mapped, so only the positions that are needed are read from the disk.
+    # decrypted_counts carries on from the number of times each character has already been decrypted
+    session_map = {}
+    maps = []
+    decrypted_counts.clear()
+    for code, entry in session['entries'].items():
+        if entry['count'] > entry['decrypted']:
+            with open(os.path.join(positions_folder, f"{code}.bin"), 'rb') as positions_file:
+                maps.append(mmap.mmap(positions_file.fileno(), 0, access=mmap.ACCESS_READ))
+            session_map[chr(int(code))] = (entry['originals'], maps[-1])
+        decrypted_counts[chr(int(code))] = entry['decrypted']
+
+    try:
+        with open(decrypted_file_path, 'ab') as decrypted_file:
+            for block, encrypted_offset in read_new_text(encrypted_file_path, session['encrypted_offset'], block_size):
+                decrypted_file.write(decrypt_block(block, session_map, session['shift1'], session['shift2']).encode('utf-8'))
+                session['encrypted_offset'] = encrypted_offset
+                session['decrypted_bytes'] = decrypted_file.tell()
+    finally:
+        for positions_map in maps:
+            positions_map.close()
+
+    # Saves the new decrypted counts in the session
+    for code, entry in session['entries'].items():
+        entry['decrypted'] = decrypted_counts.get(chr(int(code)), 0)
+    decrypted_counts.clear()
+    save_session(output_folder, session)
+
+    # Returns the path to the decrypted file
+    return decrypted_file_path
+
+
+
+def compare_files(first_path, second_path, block_size=BLOCK_SIZE, with_hash=False, start=0):
+    """
+    Compares two files one block of bytes at a time from the byte offset start and stops at the first difference.
+    Returns the byte offset of the first difference, or None if the files are identical,
+    and the CRC-32 of the bytes that matched if with_hash is True (otherwise None)
+    """
+    
+    # Two buffers are reused for every block, so the memory used stays the same no matter how large the files are
+    first_buffer = bytearray(block_size)
+    second_buffer = bytearray(block_size)
+    checksum = 0 if with_hash else None
+    offset = start
+
+    with open(first_path, 'rb') as first_file, open(second_path, 'rb') as second_file:
+        first_file.seek(start)
+        second_file.seek(start)
+        with memoryview(first_buffer) as first_view, memoryview(second_buffer) as second_view:
+            while True:
+                first_count = first_file.readinto(first_buffer)
+                second_count = second_file.readinto(second_buffer)
+                first_block = first_view[:first_count]
+                second_block = second_view[:second_count]
+
+                if first_block != second_block:
+                    # Finds the first byte that is different, or where the shorter file ended
+                    for position, (first_byte, second_byte) in enumerate(zip(first_block, second_block)):
+                        if first_byte != second_byte:
+                            break
+                    else:
+                        position = min(first_count, second_count)
+                    if with_hash:
+                        checksum = zlib.crc32(first_block[:position], checksum)
+                    first_block.release()
+                    second_block.release()
+                    return offset + position, checksum
+
+                if with_hash:
+                    checksum = zlib.crc32(first_block, checksum)
+                first_block.release()
+                second_block.release()
+                # Both files ended at the same point without any difference
+                if first_count == 0:
+                    return None, checksum
+                offset += first_count
+
+
+
 def verify_decryption(output_folder):
     """
     Verifies that the decryption was successful by comparing the decrypted text with the original raw text
@@ -175,26 +1003,178 @@ def verify_decryption(output_folder):
     # Path for the decrypted file
     decrypted_file_path = os.path.join(output_folder, 'decrypted_text.txt')
     
-    # Opens both the raw text and decrypted text files for comparison
-    with open(raw_path, 'r', encoding='utf-8') as raw_file:
-        with open(decrypted_file_path, 'r', encoding='utf-8') as decrypted_file:
-            raw_lines = raw_file.readlines()
-            decrypted_lines = decrypted_file.readlines()            
-            # Compares each line using an index
-            for x in range(len(raw_lines)):
-                if x >= len(decrypted_lines) or raw_lines[x] != decrypted_lines[x]:
-                    # Returns False if any line does not match
-                    return False
-    # Returns True if all lines match
-    return True
+    # Compares both files byte for byte, and returns True if there is no difference
+    mismatch, _ = compare_files(raw_path, decrypted_file_path)
+    return mismatch is None
 
 
 
-def main():
+def expand_inputs(patterns, output_root):
+    """
+    Turns a list of file paths, glob patterns and folders into a sorted list of files.
+    Folders are searched through completely, and anything inside output_root is skipped so earlier results are not encrypted again
+    """
+    
+    output_root = os.path.abspath(output_root)
+    found = set()
+    for pattern in patterns:
+        for match in glob.glob(pattern, recursive=True) or [pattern]:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    found.update(os.path.join(root, name) for name in files)
+            elif os.path.isfile(match):
+                found.add(match)
+            else:
+                # Raises an error if a path given on the command line does not exist
+                raise FileNotFoundError(f"{match} was not found.")
+
+    # Returns the files as absolute paths, leaving out anything in the output folder
+    files = {os.path.abspath(path) for path in found}
+    return sorted(path for path in files if os.path.commonpath([path, output_root]) != output_root)
+
+
+
+def process_file(input_path, output_folder, shift1, shift2, block_size=BLOCK_SIZE, session=False):
+    """
+    Encrypts, decrypts and verifies a single file inside a worker process, saving all the output files in output_folder.
+    If session is True, only the data added since the last run is encrypted, decrypted and verified.
+    Returns a dictionary with the timings and the verification result for the file
+    """
+    
+    global raw_path
+    
+    summary = {'input': input_path, 'output_folder': output_folder, 'bytes': os.path.getsize(input_path)}
+    try:
+        os.makedirs(output_folder, exist_ok=True)
+        # Each worker runs one file at a time, so the global path can point at the file being processed
+        raw_path = input_path
+        # In a session only the bytes after the part verified last time need to be compared
+        verify_start = load_session(output_folder, shift1, shift2)['raw_offset'] if session else 0
+
+        start = time.perf_counter()
+        if session:
+            encrypt_session(shift1, shift2, output_folder, block_size)
+        else:
+            encrypt(shift1, shift2, output_folder, block_size)
+        summary['encrypt_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if session:
+            decrypt_session(output_folder, block_size)
+        else:
+            decrypt_with_key(output_folder)
+        summary['decrypt_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if session:
+            summary['new_bytes'] = load_session(output_folder)['raw_offset'] - verify_start
+        mismatch, checksum = compare_files(input_path, os.path.join(output_folder, 'decrypted_text.txt'), block_size, True, verify_start)
+        summary['verify_seconds'] = time.perf_counter() - start
+
+        # In a session the raw file may end with part of a character that is left for the next run
+        if session and mismatch == summary.get('new_bytes', 0) + verify_start == os.path.getsize(os.path.join(output_folder, 'decrypted_text.txt')):
+            mismatch = None
+        summary['verified'] = mismatch is None
+        summary['mismatch_offset'] = mismatch
+        summary['crc32'] = f"{checksum:08x}"
+    except (OSError, UnicodeDecodeError, ValueError) as error:
+        # A file that cannot be processed is reported in the summary instead of stopping the whole batch
+        summary['verified'] = False
+        summary['error'] = str(error)
+
+    # Returns the summary for the file
+    return summary
+
+
+
+def run_batch(patterns, shift1, shift2, output_root, workers=None, block_size=BLOCK_SIZE, session=False):
+    """
+    Encrypts, decrypts and verifies many files at once using a pool of worker processes, only processing new data if session is True.
+    The output files for each input file are saved in their own folder inside output_root, with the same layout as the input files,
+    and a summary of the timings and verification results for every file is written to batch_summary.json in output_root
+    """
+    
+    output_root = os.path.abspath(output_root)
+    files = expand_inputs(patterns, output_root)
+    if not files:
+        raise FileNotFoundError("No input files were found.")
+    
+    # The output folders follow the layout of the input files, starting from the folder they all share
+    base_dir = os.path.commonpath([os.path.dirname(path) for path in files])
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    summaries = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_file, path, os.path.join(output_root, os.path.relpath(path, base_dir)), shift1, shift2, block_size, session)
+                   for path in files]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries[summary['input']] = summary
+            print(f"{'OK    ' if summary['verified'] else 'FAILED'} {summary['input']}")
+
+    # Writes the summary with the files in the same order as they were found
+    summary_path = os.path.join(output_root, 'batch_summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as summary_file:
+        json.dump({'shift1': shift1,
+                   'shift2': shift2,
+                   'session': session,
+                   'workers': workers,
+                   'total_seconds': time.perf_counter() - start,
+                   'files': [summaries[path] for path in files]}, summary_file, indent=2)
+
+    # Returns the path to the summary file and whether every file was verified
+    return summary_path, all(summary['verified'] for summary in summaries.values())
+
+
+
+def parse_arguments(argv=None):
+    """
+    Reads the command line arguments used to run the program as a batch job.
+    When no input files are given, the program asks for the shift values and uses raw_text.txt as before
+    """
+    
+    parser = argparse.ArgumentParser(description="Encrypt, decrypt and verify text files.")
+    parser.add_argument('inputs', nargs='*', help="files, folders or glob patterns to process as a batch job")
+    parser.add_argument('--shift1', type=int, choices=range(1, 10), help="the first shift value (1-9)")
+    parser.add_argument('--shift2', type=int, choices=range(1, 10), help="the second shift value (1-9)")
+    parser.add_argument('--output', default='cipher_output', help="folder where the output of a batch job is saved")
+    parser.add_argument('--workers', type=int, default=None, help="number of files processed at the same time")
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="number of characters read at a time")
+    parser.add_argument('--session', action='store_true', help="only encrypt and decrypt data appended since the last run")
+    args = parser.parse_args(argv)
+    
+    # Both shift values are needed when running without prompts
+    if args.inputs and (args.shift1 is None or args.shift2 is None):
+        parser.error("--shift1 and --shift2 are required when input files are given")
+
+    # Every input must match at least one existing file or folder, in the same way expand_inputs looks for them
+    missing = [pattern for pattern in args.inputs if not glob.glob(pattern, recursive=True) and not os.path.exists(pattern)]
+    if missing:
+        parser.error(f"no files or folders found for {', '.join(missing)}")
+
+    # At least one file has to be processed at a time
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+
+def main(argv=None):
     """
     The main function that handles the encryption and decryption process
     """
     
+    # Runs as a batch job without any prompts if input files are given on the command line
+    args = parse_arguments(argv)
+    if args.inputs:
+        summary_path, all_verified = run_batch(args.inputs, args.shift1, args.shift2, args.output, args.workers, args.block_size, args.session)
+        print(f"Batch summary written to {summary_path}")
+        if not all_verified:
+            raise SystemExit(1)
+        return
+    
     # Finds raw_text.txt dynamically
     find_raw_text()
     
@@ -204,17 +1184,22 @@ def main():
     # Prompts the user for two shift values
     shift1, shift2 = shift_input()
     
-    # Calls the encrypt function with the shift values to encrypt the text and save it to a file
-    encrypt(shift1, shift2, output_folder)
+    # Calls the encrypt function with the shift values to encrypt the text and save it to a file,
+    # files too large for a single shard are encrypted in parallel instead
+    if os.path.getsize(raw_path) > SHARD_SIZE:
+        encrypt_parallel(shift1, shift2, output_folder)
+    else:
+        encrypt(shift1, shift2, output_folder)
     
-    # Calls the decrypt function with the encryption_map to decrypt the text and save it to a file
-    decrypt(encryption_map, output_folder)
+    # Calls the decrypt_with_key function to decrypt the text using the key file saved by encrypt and save it to a file
+    decrypt_with_key(output_folder)
 
-    # Verifies that the decrypted file and the raw text file are similar
-    if verify_decryption(output_folder):
-        print("Decryption successful! The decrypted text matches the original raw text.")
+    # Verifies that the decrypted file and the raw text file are identical
+    mismatch, checksum = compare_files(raw_path, os.path.join(output_folder, 'decrypted_text.txt'), with_hash=True)
+    if mismatch is None:
+        print(f"Decryption successful! The decrypted text matches the original raw text (CRC-32 {checksum:08x}).")
     else:
-        print("Decryption failed! The decrypted text does not match the original raw text.")
+        print(f"Decryption failed! The decrypted text does not match the original raw text from byte {mismatch}.")
 
 
 if __name__ == "__main__":
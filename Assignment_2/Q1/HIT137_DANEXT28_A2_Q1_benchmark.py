@@ -0,0 +1,237 @@
+'''
+
+Group Name: DAN/EXT 28
+
+Group Members:
+FATEEN RAHMAN - s387983
+HENDRICK DANG (VAN HOI DANG)- s395598
+KEVIN ZHU (JIAWEI ZHU) - s387035
+MEHRAAB FERDOUSE - s393148
+
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import HIT137_DANEXT28_A2_Q1 as cipher
+
+
+
+# The characters used to build each kind of synthetic corpus, along with how often each group is picked
+CORPUS_MIXES = {
+    # Mostly lowercase words with spaces and punctuation, like ordinary English text
+    'ascii': [('abcdefghijklmnopqrstuvwxyz', 70), (' ', 15), ('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 5), ('.,;:!?\'"-()0123456789\n', 10)],
+    # Upper and lower case letters in equal amounts, plus the symbols that the shifted letters can collide with
+    'mixed': [('abcdefghijklmnopqrstuvwxyz', 35), ('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 35), (' \n', 10), ('@[\\]^_`{|}~<=>?;:0123456789', 20)],
+    # Accented Latin, Greek, Cyrillic, CJK characters and emoji mixed with some ASCII text
+    'unicode': [('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ ', 30), ('éèêëàâäôöûüçñßÆØÅ', 15),
+                ('αβγδεζηθλμπσφωЖЗИЛПФЦЧШЩЯ', 15), ('日本語漢字東京大学中文文字', 25), ('😀😂🙂🚀🌏🎉', 15)],
+}
+
+# The stages of the cipher that are benchmarked, in the order they are run
+STAGES = ['encrypt', 'decrypt', 'verify']
+
+
+
+def generate_corpus(path, size, mix, seed=137):
+    """
+    Writes a synthetic UTF-8 text file of about size bytes using the character groups of the chosen mix.
+    The same seed always gives the same file, so results can be compared between revisions
+    """
+
+    rng = random.Random(seed)
+    groups = [chars for chars, weight in CORPUS_MIXES[mix]]
+    weights = [weight for chars, weight in CORPUS_MIXES[mix]]
+
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        # Writes the corpus in blocks of characters so the whole file is never held in memory
+        while written < size:
+            block = ''.join(rng.choice(group) for group in rng.choices(groups, weights, k=1 << 16))
+            encoded = block.encode('utf-8')[:size - written]
+            # Cutting the block may split the last character, so only whole characters are kept
+            text = encoded.decode('utf-8', errors='ignore')
+            file.write(text)
+            written += len(text.encode('utf-8'))
+            if len(text) == 0:
+                break
+
+    # Returns the number of bytes written
+    return written
+
+
+
+def run_stage(stage, shift1, shift2, output_folder, trace_memory):
+    """
+    Runs one stage of the cipher on the current raw_path and returns how long it took in seconds and,
+    if trace_memory is True, the peak memory allocated while it ran in bytes (otherwise None)
+    """
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if stage == 'encrypt':
+        cipher.encrypt(shift1, shift2, output_folder)
+    elif stage == 'decrypt':
+        cipher.decrypt_with_key(output_folder)
+    elif not cipher.verify_decryption(output_folder):
+        raise RuntimeError(f"Decryption failed for shift values {shift1} and {shift2}.")
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # Returns the time taken and the peak memory
+    return seconds, peak
+
+
+
+def benchmark_corpus(corpus_name, corpus_path, corpus_bytes, shift_pairs, output_folder, trace_memory=True):
+    """
+    Runs every stage of the cipher for every shift pair on one corpus.
+    Each stage is timed without memory tracing, and then run again under tracemalloc to find its peak memory,
+    as tracing slows the program down too much for the timings to be fair
+    """
+
+    results = []
+    cipher.raw_path = corpus_path
+    for shift1, shift2 in shift_pairs:
+        for stage in STAGES:
+            seconds, _ = run_stage(stage, shift1, shift2, output_folder, False)
+            peak = run_stage(stage, shift1, shift2, output_folder, True)[1] if trace_memory else None
+            result = {'corpus': corpus_name,
+                      'shift1': shift1,
+                      'shift2': shift2,
+                      'stage': stage,
+                      'seconds': seconds,
+                      'mb_per_s': corpus_bytes / seconds / 1e6 if seconds else None,
+                      'peak_memory_bytes': peak}
+            if stage == 'encrypt':
+                # The map size is the number of colliding characters and the number of position bytes kept for them
+                result['map_entries'] = len(cipher.encryption_map)
+                result['map_bytes'] = sum(len(positions) for originals, positions in cipher.encryption_map.values())
+                result['key_file_bytes'] = os.path.getsize(os.path.join(output_folder, 'encryption_key.bin'))
+            results.append(result)
+        print(f"{corpus_name}: shift values {shift1} and {shift2} done")
+
+    # Returns the results for this corpus
+    return results
+
+
+
+def summarise(results):
+    """
+    Works out the mean throughput and the largest peak memory of every stage for each corpus
+    """
+
+    summary = {}
+    for result in results:
+        stage = summary.setdefault(result['corpus'], {}).setdefault(result['stage'], {'mb_per_s': [], 'peak_memory_bytes': 0})
+        stage['mb_per_s'].append(result['mb_per_s'] or 0.0)
+        stage['peak_memory_bytes'] = max(stage['peak_memory_bytes'], result['peak_memory_bytes'] or 0)
+    for stages in summary.values():
+        for stage in stages.values():
+            stage['mb_per_s'] = sum(stage['mb_per_s']) / len(stage['mb_per_s'])
+
+    # Returns the summary
+    return summary
+
+
+
+def compare_results(summary, baseline_path, tolerance):
+    """
+    Compares the mean throughput of every stage with an earlier results file.
+    Returns a list of messages for every stage that became slower by more than the tolerance
+    """
+
+    with open(baseline_path, 'r', encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)['summary']
+
+    regressions = []
+    for corpus, stages in summary.items():
+        for stage, values in stages.items():
+            previous = baseline.get(corpus, {}).get(stage)
+            if previous is None or not previous['mb_per_s']:
+                continue
+            change = values['mb_per_s']/previous['mb_per_s'] - 1
+            print(f"{corpus:>10} {stage:>8}: {values['mb_per_s']:8.2f} MB/s ({change:+.1%} compared with the baseline)")
+            if change < -tolerance:
+                regressions.append(f"{corpus} {stage} is {-change:.1%} slower than the baseline")
+
+    # Returns the list of regressions
+    return regressions
+
+
+
+def git_revision():
+    """
+    Returns the current git commit of the repository, or None if it cannot be found
+    """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def main():
+    """
+    The main function that generates the corpora, runs the benchmarks and saves the results to a JSON file
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmark the encryption program on synthetic text.")
+    parser.add_argument('--size-mb', type=float, nargs='+', default=[4.0], help="sizes of the corpora in megabytes")
+    parser.add_argument('--mix', choices=sorted(CORPUS_MIXES), nargs='+', default=sorted(CORPUS_MIXES), help="kinds of corpus to generate")
+    parser.add_argument('--pairs', type=int, default=81, help="number of shift pairs to run, out of all 81")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc runs used to measure peak memory")
+    parser.add_argument('--output', default='cipher_benchmark.json', help="file the results are written to")
+    parser.add_argument('--baseline', help="earlier results file to compare the throughput with")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="largest slowdown allowed compared with the baseline")
+    args = parser.parse_args()
+
+    shift_pairs = [(shift1, shift2) for shift1 in range(1, 10) for shift2 in range(1, 10)][:args.pairs]
+    corpora = []
+    results = []
+    with tempfile.TemporaryDirectory() as work_folder:
+        for size_mb in args.size_mb:
+            for mix in args.mix:
+                corpus_name = f"{mix}-{size_mb:g}MB"
+                corpus_path = os.path.join(work_folder, f"{corpus_name}.txt")
+                corpus_bytes = generate_corpus(corpus_path, int(size_mb*1e6), mix)
+                corpora.append({'name': corpus_name, 'mix': mix, 'bytes': corpus_bytes})
+                results.extend(benchmark_corpus(corpus_name, corpus_path, corpus_bytes, shift_pairs, work_folder, not args.no_memory))
+                os.remove(corpus_path)
+
+    summary = summarise(results)
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump({'revision': git_revision(),
+                   'python': platform.python_version(),
+                   'numpy': cipher.np.__version__ if cipher.np is not None else None,
+                   'block_size': cipher.BLOCK_SIZE,
+                   'corpora': corpora,
+                   'summary': summary,
+                   'results': results}, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+    # Compares the results with the baseline and exits with an error if any stage became too slow
+    if args.baseline:
+        regressions = compare_results(summary, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
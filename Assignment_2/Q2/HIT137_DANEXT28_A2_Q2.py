@@ -10,169 +10,1192 @@ MEHRAAB FERDOUSE - s393148
 
 '''
 
+import argparse
+import json
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 
 
 
-def dataframe_concat():
+# The month columns of every CSV file, in order
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+
+# The months that make up each season
+SEASONS = {'Summer': ['January', 'February', 'December'],
+           'Winter': ['June', 'July', 'August'],
+           'Autumn': ['March', 'April', 'May'],
+           'Spring': ['September', 'October', 'November']}
+
+# The columns read from every CSV file and their types, so pandas does not have to guess them.
+# Month temperatures only need single precision and station names repeat every year, so they are stored as categories
+CSV_DTYPES = {'STATION_NAME': 'category', 'STN_ID': 'int32', 'LAT': 'float32', 'LON': 'float32', **{month: 'float32' for month in MONTHS}}
+
+# The version of the cache of parsed CSV files saved in the 'temperatures_cache' folder next to the 'temperatures' folder
+CACHE_VERSION = 1
+
+# The version of aggregate_state.npz, which holds the running totals used to update the results when new CSV files arrive
+AGGREGATE_VERSION = 1
+
+# The number of rows read from a CSV file at a time when the temperatures are streamed instead of loaded all at once
+CHUNK_ROWS = 50000
+
+# The size in degrees of the latitude and longitude cells of the spatial index, and the mean radius of the Earth in kilometres
+SPATIAL_CELL_DEGREES = 1.0
+EARTH_RADIUS_KM = 6371.0088
+
+# The version of season_cube.npz, which holds the sum, count, minimum and maximum of every station, year and season
+CUBE_VERSION = 1
+
+# The state of a station is given by the first digits of its Bureau of Meteorology station number (STN_ID // 1000),
+# listed as the largest prefix of each state
+STATE_PREFIXES = [(13, 'WA'), (15, 'NT'), (26, 'SA'), (45, 'QLD'), (75, 'NSW'), (90, 'VIC'), (99, 'TAS')]
+
+# The size of the quantile sketch kept for every station and season. Larger sketches are more accurate but use more memory,
+# with a rank error of about 1.7/SKETCH_K
+SKETCH_K = 200
+
+# The seed of the random numbers that choose which values are kept when a sketch is compressed, so the results are the same every run
+SKETCH_SEED = 137
+
+# The percentiles written to temperature_percentiles.txt
+PERCENTILES = [5, 50, 95]
+
+
+
+def file_year(file_name):
     """
-    Locates the 'temperatures' folder and also concatenates all CSV files in the specified directory into a single dataframe
+    Returns the year in the name of a CSV file, for example 1986 for stations_group_1986.csv
     """
     
-    dataframes = []
+    match = re.search(r'(\d{4})\D*$', file_name)
+    if match is None:
+        # Raises an error if the file name has no year in it
+        raise ValueError(f"No year found in the file name {file_name}.")
+    return int(match.group(1))
 
-    # Finds the absolute path to the 'temperatures' folder no matter where it is located
+
+
+def find_temperatures_folder():
+    """
+    Finds the absolute path to the 'temperatures' folder no matter where it is located
+    """
+    
     base_dir = os.getcwd()
     for root, dirs, files in os.walk(base_dir):
         if 'temperatures' in dirs:
-            temperatures_path = os.path.join(root, 'temperatures')
-            break
+            return os.path.join(root, 'temperatures')
+    # Raises an error if the 'temperatures' folder is not found
+    raise FileNotFoundError("temperatures folder not found in the current directory tree.")
+
+
+
+def read_temperature_file(path):
+    """
+    Reads a single CSV file using only the columns in CSV_DTYPES and their types,
+    and adds the year taken from the file name (for example stations_group_1986.csv) as a column
+    """
+    
+    df = pd.read_csv(path, usecols=list(CSV_DTYPES), dtype=CSV_DTYPES)
+    df['YEAR'] = np.int16(file_year(os.path.basename(path)))
+    return df
+
+
+
+def concat_temperature_frames(dataframes):
+    """
+    Concatenates dataframes of temperatures into a single dataframe. Each dataframe has its own station name categories,
+    so they are combined into one set of categories instead of being turned back into plain strings
+    """
+    
+    all_temperatures = pd.concat(dataframes, ignore_index=True)
+    all_temperatures['STATION_NAME'] = pd.api.types.union_categoricals([df['STATION_NAME'] for df in dataframes])
+    return all_temperatures
+
+
+
+def load_cache(cache_path):
+    """
+    Loads the manifest of the cache and memory maps every cached column.
+    Returns the manifest and a dataframe built from the cached columns, or None if there is no usable cache
+    """
+    
+    manifest_path = os.path.join(cache_path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+        manifest = json.load(manifest_file)
+    # A cache written by another version or with other columns cannot be used
+    if manifest.get('version') != CACHE_VERSION or manifest.get('columns') != list(CSV_DTYPES):
+        return None
+
+    # Every column is memory mapped, and the station names are rebuilt from their category codes
+    columns = {}
+    for column in manifest['columns'] + ['YEAR']:
+        values = np.load(os.path.join(cache_path, f"{column}.npy"), mmap_mode='r')
+        if column == 'STATION_NAME':
+            values = pd.Categorical.from_codes(values, manifest['station_names'])
+        columns[column] = values
+
+    # Returns the manifest and the cached dataframe. copy=False keeps every column backed by its memory mapped file
+    # instead of copying it into memory, so the parts of a column are only read from the disk when they are used
+    return manifest, pd.DataFrame(columns, copy=False)
+
+
+
+def save_cache(cache_path, files, all_temperatures):
+    """
+    Saves every column of the dataframe as a .npy file in the cache folder along with a manifest
+    of the path, size, modification time and number of rows of each CSV file
+    """
+    
+    os.makedirs(cache_path, exist_ok=True)
+    manifest_path = os.path.join(cache_path, 'manifest.json')
+    # The old manifest is removed first, so a cache that is only partly written is never used
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
 
-    # Iterates through all CSV files in the 'temperatures' folder and reads them into dataframes
+    # Each column is written to a temporary file which then replaces the old one. The dataframe being saved can still be
+    # memory mapped from the old files, so writing over them in place would change the data while it is being saved
+    for column in list(CSV_DTYPES) + ['YEAR']:
+        values = all_temperatures[column]
+        values = values.cat.codes.to_numpy() if column == 'STATION_NAME' else values.to_numpy()
+        column_path = os.path.join(cache_path, f"{column}.npy")
+        with open(column_path + '.tmp', 'wb') as column_file:
+            np.save(column_file, values)
+        os.replace(column_path + '.tmp', column_path)
+
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump({'version': CACHE_VERSION,
+                   'columns': list(CSV_DTYPES),
+                   'station_names': all_temperatures['STATION_NAME'].cat.categories.tolist(),
+                   'files': files}, manifest_file, indent=2)
+
+
+
+def dataframe_concat(temperatures_path=None, workers=None, use_cache=True):
+    """
+    Locates the 'temperatures' folder and also concatenates all CSV files in the specified directory into a single dataframe.
+    The parsed files are cached in a 'temperatures_cache' folder next to the 'temperatures' folder, so later runs only read
+    the CSV files that are new or have changed since, and the files that need reading are read at the same time by a pool of threads
+    """
+    
+    # Finds the 'temperatures' folder if its path was not given
+    if temperatures_path is None:
+        temperatures_path = find_temperatures_folder()
+    cache_path = os.path.join(os.path.dirname(temperatures_path), 'temperatures_cache')
+
+    # Lists all CSV files in the 'temperatures' folder in order of their names, along with their sizes and modification times
     with os.scandir(temperatures_path) as temperatures:
-        for file in temperatures:
-            if file.name.endswith(".csv"):
-                df = pd.read_csv(file.path)
-                dataframes.append(df)
+        files = [{'name': file.name, 'path': file.path, 'size': file.stat().st_size, 'mtime_ns': file.stat().st_mtime_ns}
+                 for file in temperatures if file.name.endswith(".csv")]
+    files.sort(key=lambda file: file['name'])
+    if not files:
+        # Raises an error if there are no CSV files to read
+        raise FileNotFoundError(f"No CSV files found in {temperatures_path}.")
+
+    # Finds the rows of every file that is already in the cache and has not changed since
+    cached = load_cache(cache_path) if use_cache else None
+    cached_rows = {}
+    if cached is not None:
+        manifest, cached_temperatures = cached
+        start = 0
+        for entry in manifest['files']:
+            cached_rows[(entry['name'], entry['size'], entry['mtime_ns'])] = (start, start + entry['rows'])
+            start += entry['rows']
+        # Uses the cache straight away if nothing has changed
+        if [(entry['name'], entry['size'], entry['mtime_ns']) for entry in manifest['files']] == \
+           [(file['name'], file['size'], file['mtime_ns']) for file in files]:
+            return cached_temperatures, temperatures_path
+
+    # Reads the new and changed CSV files into dataframes using a pool of threads
+    changed = [file for file in files if (file['name'], file['size'], file['mtime_ns']) not in cached_rows]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        read_frames = dict(zip((file['name'] for file in changed), executor.map(read_temperature_file, (file['path'] for file in changed))))
+
+    # Puts the cached and the newly read rows together in order of the file names
+    dataframes = []
+    for file in files:
+        rows = cached_rows.get((file['name'], file['size'], file['mtime_ns']))
+        dataframes.append(cached_temperatures.iloc[rows[0]:rows[1]] if rows is not None else read_frames[file['name']])
+        file['rows'] = len(dataframes[-1])
+    all_temperatures = concat_temperature_frames(dataframes)
 
-    # Concatenates all dataframes into a single dataframe and returns it and also returns the path to the 'temperatures' folder
-    return (pd.concat(dataframes, ignore_index=True)), temperatures_path
+    # Saves the new cache
+    if use_cache:
+        save_cache(cache_path, files, all_temperatures)
+
+    # Returns the concatenated dataframe and also returns the path to the 'temperatures' folder
+    return all_temperatures, temperatures_path
 
 
 
 def extract_station_temperatures(all_temperatures):
     """
-    Extracts the temperatures for each station across all years and stores them in a dictionary
-    """
-    
-    # Creates a dictionary to store the temperatures for each station across every year
-    extracted_temps = {}
-    months = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
-    num_rows = all_temperatures.shape[0]
-
-    # Since the concatenated dataframe has 112 unique rows/stations that repeat in the same order for every year,
-    # we only need to iterate through the first 112 rows to get the station names
-    for unique_rows in range(112):
-        station_name = all_temperatures.iloc[unique_rows]['STATION_NAME']
-        temps_list = []
-        # A step of 112 is used in the for loop to get the temperature values for each station across all years.
-        # This is because the dataframe is structured such that each station's data appears every 112 rows
-        for repeat_station_rows in range(unique_rows, num_rows, 112):
-            temps = all_temperatures.iloc[repeat_station_rows][months].tolist()
-            temps_list.extend(temps)
-        extracted_temps[station_name] = temps_list
+    Reshapes the concatenated dataframe into a NumPy array of temperatures with one row per station, one column per year and one value per month.
+    Stations are matched by STN_ID and years by the YEAR column, so files can list the stations in any order,
+    and any station or year that is missing from a file is filled with NaN. A station listed more than once in the same year raises a ValueError.
+    Returns a dictionary with the station IDs, the station names, the years and the temperature array
+    """
+    
+    # Finds every unique station ID and year, along with the row and column of the array that each row of the dataframe belongs in
+    station_ids, station_index = np.unique(all_temperatures['STN_ID'].to_numpy(), return_inverse=True)
+    years, year_index = np.unique(all_temperatures['YEAR'].to_numpy(), return_inverse=True)
+
+    # Each station can only have one row per year, as a second row would overwrite the first in the array
+    cells = station_index*len(years) + year_index
+    unique_cells, cell_counts = np.unique(cells, return_counts=True)
+    if (cell_counts > 1).any():
+        duplicate = unique_cells[np.argmax(cell_counts > 1)]
+        raise ValueError(f"Station {station_ids[duplicate // len(years)]} has more than one row for the year {years[duplicate % len(years)]}.")
+
+    # Creates an array full of NaN and places the twelve monthly temperatures of every row into it in one step
+    temps = np.full((len(station_ids), len(years), len(MONTHS)), np.nan)
+    temps[station_index, year_index] = all_temperatures[MONTHS].to_numpy(dtype=float)
+
+    # Uses the name and coordinates from the first row of each station
+    first_rows = np.unique(station_index, return_index=True)[1]
+    stations = all_temperatures['STATION_NAME'].to_numpy()[first_rows].tolist()
+    lats = all_temperatures['LAT'].to_numpy(dtype=float)[first_rows]
+    lons = all_temperatures['LON'].to_numpy(dtype=float)[first_rows]
         
     # Returns the dictionary containing the temperatures for each station
-    return extracted_temps
+    return {'station_ids': station_ids, 'stations': stations, 'lats': lats, 'lons': lons, 'years': years, 'temps': temps}
 
 
 
-def calculate_averages(all_temperatures):
+def select_stations(station_temps, rows):
     """
-    Calculates the average temperatures for each season and returns a dictionary with the results
+    Returns a copy of the station temperatures dictionary holding only the stations in the given rows, in the same order,
+    so it can be passed to any of the calculations in place of every station
     """
     
-    # Calculates the average temperatures for each season
-    summer_avgs = all_temperatures[['January', 'February', 'December']].mean()
-    total_summer_avg = summer_avgs.mean()
+    rows = np.asarray(rows, dtype=np.int64)
+    return {'station_ids': station_temps['station_ids'][rows],
+            'stations': [station_temps['stations'][row] for row in rows],
+            'lats': station_temps['lats'][rows],
+            'lons': station_temps['lons'][rows],
+            'years': station_temps['years'],
+            'temps': station_temps['temps'][rows]}
 
-    winter_avgs = all_temperatures[['June', 'July', 'August']].mean()
-    total_winter_avg = winter_avgs.mean()    
 
-    autumn_avgs = all_temperatures[['March', 'April', 'May']].mean()
-    total_autumn_avg = autumn_avgs.mean()
 
-    spring_avgs = all_temperatures[['September', 'October', 'November']].mean()
-    total_spring_avg = spring_avgs.mean()
+def station_series(station_temps):
+    """
+    Flattens the temperature array so each station has a single row of monthly temperatures across every year,
+    and returns it along with a mask of the stations that have at least one temperature
+    """
+    
+    series = station_temps['temps'].reshape(len(station_temps['stations']), -1)
+    return series, ~np.isnan(series).all(axis=1)
 
-    # Returns a dictionary with the average temperatures for each season
-    return {'Summer': total_summer_avg,
-            'Winter': total_winter_avg,
-            'Autumn': total_autumn_avg,
-            'Spring': total_spring_avg}
+
+
+def build_range_index(station_temps):
+    """
+    Builds an index over the monthly temperatures of every station so the count, mean, standard deviation, minimum and maximum
+    of any station between any two months can be found in constant time.
+    Means and standard deviations come from prefix sums of the values and of their squares, and minimums and maximums come from
+    sparse tables, where level j holds the minimum and maximum of every run of 2**j months
+    """
     
+    series, _ = station_series(station_temps)
+    valid = ~np.isnan(series)
+
+    # The values are taken away from each station's mean before squaring so the prefix sums of squares stay accurate.
+    # The mean is the sum over the count, where a station with no temperatures gets a mean of 0 without a warning
+    offsets = np.where(valid, series, 0.0).sum(axis=1)/np.maximum(valid.sum(axis=1), 1)
+    centred = np.where(valid, series - offsets[:, None], 0.0)
+
+    # Every prefix sum starts with a column of zeros, so the total of months start to end is prefix[end] - prefix[start]
+    def prefix_sum(values):
+        return np.concatenate([np.zeros((len(values), 1)), np.cumsum(values, axis=1)], axis=1)
 
+    # Each level of the sparse tables is built from two overlapping runs of the level below it,
+    # with missing months filled with infinity so they never become the minimum or maximum
+    mins = [np.where(valid, series, np.inf)]
+    maxs = [np.where(valid, series, -np.inf)]
+    while 2**len(mins) <= series.shape[1]:
+        half = 2**(len(mins) - 1)
+        mins.append(np.minimum(mins[-1][:, :-half], mins[-1][:, half:]))
+        maxs.append(np.maximum(maxs[-1][:, :-half], maxs[-1][:, half:]))
 
-def calculate_largest_temp_range(all_temps_per_station):
+    # Every month in the series is labelled with year*12 + month - 1, which is used to find the months of a query
+    month_keys = (np.asarray(station_temps['years'], dtype=np.int64)[:, None]*12 + np.arange(len(MONTHS))).ravel()
+
+    # Returns the index
+    return {'station_ids': station_temps['station_ids'], 'stations': station_temps['stations'], 'month_keys': month_keys,
+            'offsets': offsets, 'counts': prefix_sum(valid), 'sums': prefix_sum(centred), 'squares': prefix_sum(centred**2),
+            'mins': mins, 'maxs': maxs}
+
+
+
+def parse_month(text):
     """
-    Calculates the largest temperature range for each station and returns a dictionary with the results
+    Converts a month written as YYYY-MM into year*12 + month - 1
     """
+    
+    match = re.fullmatch(r"(\d{4})-(\d{1,2})", text.strip())
+    if match is None or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f"'{text}' is not a month in the form YYYY-MM.")
+    return int(match.group(1))*12 + int(match.group(2)) - 1
 
-    # The maximum temperature, minimum temperature, and the range between those values for each station is calculated and added to a dictionary
-    station_ranges = {}
-    max_range = None
 
-    for station, temps in all_temps_per_station.items():
-        temp_range = max(temps) - min(temps)
-        station_ranges[station] = {
-            'range': temp_range,
-            'min': min(temps),
-            'max': max(temps)}
-        
-        if (max_range is None) or (temp_range > max_range):
-            max_range = temp_range
-
-    # The ranges from the previous dictionary are compared to find the stations with the largest temperature range
-    # and a new dictionary is created to store these stations and their temperature ranges
-    highest_ranges_dict = {}
-    for station, minmaxrange in station_ranges.items():
-        if minmaxrange['range'] == max_range:
-            highest_ranges_dict[station] = {
-                'range': minmaxrange['range'],
-                'max': minmaxrange['max'],
-                'min': minmaxrange['min']}
+
+def find_station(range_index, station):
+    """
+    Returns the row of a station in the index, found by its STN_ID or by its name (ignoring case)
+    """
+    
+    if str(station).strip().isdigit():
+        rows = np.flatnonzero(range_index['station_ids'] == int(station))
+        if len(rows):
+            return rows[0]
+    names = [name.lower() for name in range_index['stations']]
+    if str(station).strip().lower() in names:
+        return names.index(str(station).strip().lower())
+    raise ValueError(f"No station called '{station}' was found.")
+
+
+
+def query_range(range_index, station, start, end):
+    """
+    Returns the count, mean, standard deviation, minimum and maximum temperature of a station from the start month to the end month,
+    both included and written as YYYY-MM. Values that cannot be worked out, such as the mean of a period with no temperatures, are NaN
+    """
+    
+    row = find_station(range_index, station)
+    first = np.searchsorted(range_index['month_keys'], parse_month(start), side='left')
+    last = np.searchsorted(range_index['month_keys'], parse_month(end), side='right')
+    result = {'station': range_index['stations'][row], 'start': start, 'end': end,
+              'count': 0, 'mean': np.nan, 'std_dev': np.nan, 'min': np.nan, 'max': np.nan}
+    if last <= first:
+        return result
+
+    # The count, sum and sum of squares of the period come from the difference of two prefix sums
+    count = int(range_index['counts'][row, last] - range_index['counts'][row, first])
+    total = range_index['sums'][row, last] - range_index['sums'][row, first]
+    squares = range_index['squares'][row, last] - range_index['squares'][row, first]
+    result['count'] = count
+    if count > 0:
+        result['mean'] = range_index['offsets'][row] + total/count
+    if count > 1:
+        result['std_dev'] = np.sqrt(max(squares - total**2/count, 0.0)/(count - 1))
+
+    # Two runs of 2**level months, one from each end of the period, cover the whole period between them
+    level = int(last - first).bit_length() - 1
+    low = min(range_index['mins'][level][row, first], range_index['mins'][level][row, last - 2**level])
+    high = max(range_index['maxs'][level][row, first], range_index['maxs'][level][row, last - 2**level])
+    if count > 0:
+        result['min'], result['max'] = low, high
+
+    # Returns the results of the query
+    return result
+
+
+
+def build_spatial_index(station_temps, cell_degrees=SPATIAL_CELL_DEGREES):
+    """
+    Builds a grid over the station coordinates, where every cell of cell_degrees by cell_degrees holds the rows of the stations inside it.
+    A query only looks at the stations in the cells its area touches instead of every station
+    """
+    
+    lats, lons = station_temps['lats'], station_temps['lons']
+    cell_rows = np.floor((lats + 90)/cell_degrees).astype(np.int64)
+    cell_columns = np.floor((lons + 180)/cell_degrees).astype(np.int64)
+
+    # Sorts the stations by cell so the rows of each cell are next to each other, then splits them into one array per cell
+    cell_keys = np.stack([cell_rows, cell_columns], axis=1)
+    cells, cell_index = np.unique(cell_keys, axis=0, return_inverse=True)
+    order = np.argsort(cell_index.ravel(), kind='stable')
+    groups = np.split(order, np.cumsum(np.bincount(cell_index.ravel(), minlength=len(cells)))[:-1])
+
+    # Returns the index
+    return {'lats': lats, 'lons': lons, 'cell_degrees': cell_degrees,
+            'columns': int(round(360/cell_degrees)),
+            'cells': {(int(row), int(column)): rows for (row, column), rows in zip(cells, groups)}}
+
+
+
+def cell_candidates(spatial_index, lat_min, lat_max, lon_min, lon_max):
+    """
+    Returns the rows of every station in the cells that overlap a box of latitudes and longitudes.
+    Longitudes outside -180 to 180 wrap around, so a box can cross the 180th meridian
+    """
+    
+    size = spatial_index['cell_degrees']
+    first_row = int(np.floor((max(lat_min, -90.0) + 90)/size))
+    last_row = int(np.floor((min(lat_max, 90.0) + 90)/size))
+    first_column = int(np.floor((lon_min + 180)/size))
+    last_column = int(np.floor((lon_max + 180)/size))
+    # A box at least as wide as the Earth covers every column
+    if last_column - first_column + 1 >= spatial_index['columns']:
+        first_column, last_column = 0, spatial_index['columns'] - 1
+
+    found = [spatial_index['cells'][(row, column % spatial_index['columns'])]
+             for row in range(first_row, last_row + 1)
+             for column in range(first_column, last_column + 1)
+             if (row, column % spatial_index['columns']) in spatial_index['cells']]
+    return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+
+
+def haversine_km(lat, lon, lats, lons):
+    """
+    Returns the great circle distance in kilometres from one point to an array of points
+    """
+    
+    lat, lon, lats, lons = np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat)/2)**2 + np.cos(lat)*np.cos(lats)*np.sin((lons - lon)/2)**2
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+
+def stations_within_radius(spatial_index, lat, lon, radius_km):
+    """
+    Returns the rows of every station within radius_km kilometres of a point, sorted by row
+    """
+    
+    # The box around the circle is one degree of latitude for every 111.2 km, and wider in longitude away from the equator
+    lat_span = np.degrees(radius_km/EARTH_RADIUS_KM)
+    widest = min(abs(lat) + lat_span, 90.0)
+    lon_span = 360.0 if widest >= 89.9 else lat_span/np.cos(np.radians(widest))
+    candidates = cell_candidates(spatial_index, lat - lat_span, lat + lat_span, lon - lon_span, lon + lon_span)
+
+    # Only the stations in the candidate cells have their distance checked
+    distances = haversine_km(lat, lon, spatial_index['lats'][candidates], spatial_index['lons'][candidates])
+    return np.sort(candidates[distances <= radius_km])
+
+
+
+def stations_in_box(spatial_index, lat_min, lat_max, lon_min, lon_max):
+    """
+    Returns the rows of every station inside a box of latitudes and longitudes, sorted by row.
+    If lon_min is larger than lon_max the box crosses the 180th meridian
+    """
+    
+    if lat_min > lat_max:
+        raise ValueError("The minimum latitude must not be larger than the maximum latitude.")
+    if lon_min > lon_max:
+        lon_max += 360
+    candidates = cell_candidates(spatial_index, lat_min, lat_max, lon_min, lon_max)
+
+    # Longitudes are compared after moving them to the same turn of the Earth as lon_min
+    lats = spatial_index['lats'][candidates]
+    lons = (spatial_index['lons'][candidates] - lon_min) % 360 + lon_min
+    return np.sort(candidates[(lats >= lat_min) & (lats <= lat_max) & (lons <= lon_max)])
+
+
+
+def calculate_averages(station_temps):
+    """
+    Calculates the average temperatures for each season and returns a dictionary with the results
+    """
+    
+    # Calculates the average temperature of each month across every station and year, then averages the months of each season
+    month_avgs = dict(zip(MONTHS, np.nanmean(station_temps['temps'], axis=(0, 1))))
+    
+    # Returns a dictionary with the average temperatures for each season
+    return {season: np.nanmean([month_avgs[month] for month in months]) for season, months in SEASONS.items()}
+    
+
+
+def calculate_largest_temp_range(station_temps, top_k=1):
+    """
+    Calculates the temperature range of each station and returns the top_k stations with the largest range,
+    along with any other stations tied with the last of them
+    """
+
+    # The maximum temperature, minimum temperature, and the range between those values for each station is calculated at once
+    series, has_data = station_series(station_temps)
+    maxs = np.full(len(series), np.nan)
+    mins = np.full(len(series), np.nan)
+    maxs[has_data] = np.nanmax(series[has_data], axis=1)
+    mins[has_data] = np.nanmin(series[has_data], axis=1)
             
-    # Returns the dictionary containing the stations with the largest temperature range
-    return highest_ranges_dict
+    # Returns the list of stations with the largest temperature ranges
+    return largest_ranges(station_temps['stations'], mins, maxs, top_k)
 
 
 
-def calculate_most_stable_temperature(all_temps_per_station):
+def top_k_indices(values, names, top_k, largest=False):
     """
-    Calculates the station with the most stable temperature and returns its name and standard deviation
-    as well as the station with the most variable temperature and returns its name and standard deviation
+    Returns the positions of the top_k smallest values, or the largest if largest is True, skipping NaN values.
+    Any values tied with the last of the top_k are included as well, and the positions are ordered by value and then by name
+    so ties are always reported in the same order
     """
     
-    # The station with the most stable temperature is determined by calculating the standard deviation of the temperatures for each station
-    # The station with the most variable temperature is also determined in the same way
-    most_stable_station = None
-    lowest_std_dev = None
-    most_variable_station = None
-    highest_std_dev = None
+    candidates = np.flatnonzero(~np.isnan(values))
+    if top_k < 1 or len(candidates) == 0:
+        return candidates[:0]
+    keys = -values[candidates] if largest else values[candidates]
 
-    for station, temps in all_temps_per_station.items():
-        std_dev = pd.Series(temps).std()
-        if (lowest_std_dev is None) or (std_dev < lowest_std_dev):
-            lowest_std_dev = std_dev
-            most_stable_station = station
-        if (highest_std_dev is None) or (std_dev > highest_std_dev):
-            highest_std_dev = std_dev
-            most_variable_station = station
+    # Partitioning finds the top_k-th value without sorting every station, then only the values up to it are kept
+    if top_k < len(candidates):
+        kth_key = np.partition(keys, top_k - 1)[top_k - 1]
+        candidates, keys = candidates[keys <= kth_key], keys[keys <= kth_key]
+
+    # Only the kept values are sorted, by value first and then by name
+    return candidates[np.lexsort((np.asarray(names)[candidates], keys))]
+
+
+
+def largest_ranges(stations, mins, maxs, top_k=1):
+    """
+    Finds the top_k stations with the largest temperature range from the minimum and maximum temperature of every station
+    and returns a list with their names, ranges, maximums and minimums, starting with the largest range
+    """
+    
+    ranges = maxs - mins
+
+    # The stations with the largest temperature ranges are added to a list
+    return [{'station': stations[index], 'range': ranges[index], 'max': maxs[index], 'min': mins[index]}
+            for index in top_k_indices(ranges, stations, top_k, largest=True)]
+
+
+
+def calculate_most_stable_temperature(station_temps, top_k=1):
+    """
+    Calculates the top_k stations with the most stable temperature and returns their names and standard deviations
+    as well as the top_k stations with the most variable temperature and returns their names and standard deviations
+    """
+    
+    # The standard deviation of the temperatures for every station is calculated at once,
+    # stations with fewer than two temperatures do not have one and are left as NaN
+    series, _ = station_series(station_temps)
+    counts = (~np.isnan(series)).sum(axis=1)
+    std_devs = np.full(len(series), np.nan)
+    std_devs[counts > 1] = np.nanstd(series[counts > 1], axis=1, ddof=1)
 
     # Returns the names and standard deviations of the most stable and most variable stations
-    return {'Most Stable': {'station': most_stable_station, 'std_dev': lowest_std_dev},
-            'Most Variable': {'station': most_variable_station, 'std_dev': highest_std_dev}}
+    return most_stable_and_variable(station_temps['stations'], std_devs, top_k)
+
+
+
+def most_stable_and_variable(stations, std_devs, top_k=1):
+    """
+    Finds the top_k stations with the lowest and highest standard deviation and returns lists of their names and standard deviations
+    """
     
+    # The stations with the lowest standard deviations are the most stable and the ones with the highest are the most variable
+    return {'Most Stable': [{'station': stations[index], 'std_dev': std_devs[index]} for index in top_k_indices(std_devs, stations, top_k)],
+            'Most Variable': [{'station': stations[index], 'std_dev': std_devs[index]} for index in top_k_indices(std_devs, stations, top_k, largest=True)]}
+
+
+
+def combine_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    """
+    Combines two sets of counts, means and sums of squared differences from the mean (M2), as used by Welford's algorithm,
+    into the counts, means and M2 of both sets together. Works on whole arrays at once
+    """
     
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share_b = np.where(count > 0, count_b/count, 0.0)
+    mean = mean_a + delta*share_b
+    m2 = m2_a + m2_b + delta**2*count_a*share_b
+    return count, mean, m2
+
+
 
-def main():
+def partial_moments(values, station_index, station_count):
     """
-    The main function that reads data from CSV files, analyses it, then writes the results to text files
+    Calculates the count, mean, M2, minimum and maximum of every station from a 2D array of values
+    with one row per CSV row, where station_index gives the station of each row. NaN values are skipped
+    """
+    
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    count = np.bincount(station_index, weights=valid.sum(axis=1), minlength=station_count)
+    total = np.bincount(station_index, weights=filled.sum(axis=1), minlength=station_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total/count, 0.0)
+    # The squared differences are taken from the mean of each value's own station
+    squares = np.where(valid, (values - mean[station_index, None])**2, 0.0)
+    m2 = np.bincount(station_index, weights=squares.sum(axis=1), minlength=station_count)
+
+    # fmin and fmax skip NaN values, so stations with no values are left as NaN
+    mins = np.full(station_count, np.nan)
+    maxs = np.full(station_count, np.nan)
+    np.fmin.at(mins, station_index, np.fmin.reduce(values, axis=1))
+    np.fmax.at(maxs, station_index, np.fmax.reduce(values, axis=1))
+    return count, mean, m2, mins, maxs
+
+
+
+def partial_aggregates(temperatures):
+    """
+    Calculates the aggregate state of a dataframe of temperatures, which can be one CSV file or part of one.
+    The state holds, for every station, the count and sum of each month, the count, mean, M2, minimum and maximum of all its
+    temperatures, and the same for each season. States of different files can be merged using merge_aggregates
     """
+    
+    station_ids, first_rows, station_index = np.unique(temperatures['STN_ID'].to_numpy(), return_index=True, return_inverse=True)
+    station_count = len(station_ids)
+    values = temperatures[MONTHS].to_numpy(dtype=float)
+
+    state = {'station_ids': station_ids,
+             'stations': np.asarray(temperatures['STATION_NAME'].to_numpy()[first_rows], dtype=str)}
+
+    # The count and sum of every month for each station, used for the seasonal averages
+    valid = ~np.isnan(values)
+    state['month_count'] = np.zeros((station_count, len(MONTHS)))
+    state['month_sum'] = np.zeros((station_count, len(MONTHS)))
+    np.add.at(state['month_count'], station_index, valid)
+    np.add.at(state['month_sum'], station_index, np.where(valid, values, 0.0))
+
+    # The moments of all the temperatures of each station, used for the ranges and standard deviations
+    state['count'], state['mean'], state['m2'], state['min'], state['max'] = partial_moments(values, station_index, station_count)
+
+    # The moments of each season of each station, stored with one column per season
+    season_moments = [partial_moments(values[:, [MONTHS.index(month) for month in months]], station_index, station_count)
+                      for months in SEASONS.values()]
+    for number, name in enumerate(['season_count', 'season_mean', 'season_m2', 'season_min', 'season_max']):
+        state[name] = np.stack([moments[number] for moments in season_moments], axis=1)
 
-    # Assigns the concatenated dataframe and folder path to variables
-    all_temperatures, temperatures_path = dataframe_concat()
-    # Assigns the station names and their temperatures across every year to a dictionary
-    all_temps_per_station = extract_station_temperatures(all_temperatures)
+    # Returns the aggregate state
+    return state
 
-    # Determines the parent folder of the 'temperatures' folder so the output files are saved there
-    output_folder = os.path.dirname(temperatures_path)
+
+
+def empty_aggregates():
+    """
+    Returns an aggregate state with no stations in it
+    """
+    
+    state = {'station_ids': np.zeros(0, dtype=np.int64), 'stations': np.zeros(0, dtype=str),
+             'month_count': np.zeros((0, len(MONTHS))), 'month_sum': np.zeros((0, len(MONTHS)))}
+    for name in ['count', 'mean', 'm2', 'min', 'max']:
+        state[name] = np.zeros(0) if name in ('count', 'mean', 'm2') else np.full(0, np.nan)
+        state[f"season_{name}"] = np.zeros((0, len(SEASONS))) if name in ('count', 'mean', 'm2') else np.full((0, len(SEASONS)), np.nan)
+    return state
+
+
+
+def merge_aggregates(state_a, state_b):
+    """
+    Merges two aggregate states into one, matching their stations by STN_ID.
+    Counts and sums are added, means and M2 are combined with combine_moments, and minimums and maximums are compared
+    """
+    
+    # Lines up the stations of both states with the sorted list of all their station IDs
+    station_ids = np.union1d(state_a['station_ids'], state_b['station_ids'])
+    rows_a = np.searchsorted(station_ids, state_a['station_ids'])
+    rows_b = np.searchsorted(station_ids, state_b['station_ids'])
+
+    def spread(state, rows, name, fill):
+        # Places the values of one state into the rows of the merged stations, filling the stations it does not have
+        values = np.full((len(station_ids),) + state[name].shape[1:], fill, dtype=state[name].dtype)
+        values[rows] = state[name]
+        return values
+
+    merged = {'station_ids': station_ids}
+    merged['stations'] = spread(state_b, rows_b, 'stations', '')
+    names_a = spread(state_a, rows_a, 'stations', '')
+    merged['stations'] = np.where(np.isin(station_ids, state_a['station_ids']), names_a, merged['stations'])
+
+    for name in ['month_count', 'month_sum']:
+        merged[name] = spread(state_a, rows_a, name, 0.0) + spread(state_b, rows_b, name, 0.0)
+    for prefix in ['', 'season_']:
+        moments_a = [spread(state_a, rows_a, f"{prefix}{name}", 0.0) for name in ['count', 'mean', 'm2']]
+        moments_b = [spread(state_b, rows_b, f"{prefix}{name}", 0.0) for name in ['count', 'mean', 'm2']]
+        merged[f"{prefix}count"], merged[f"{prefix}mean"], merged[f"{prefix}m2"] = combine_moments(*moments_a, *moments_b)
+        merged[f"{prefix}min"] = np.fmin(spread(state_a, rows_a, f"{prefix}min", np.nan), spread(state_b, rows_b, f"{prefix}min", np.nan))
+        merged[f"{prefix}max"] = np.fmax(spread(state_a, rows_a, f"{prefix}max", np.nan), spread(state_b, rows_b, f"{prefix}max", np.nan))
+
+    # Returns the merged state
+    return merged
+
+
+
+def csv_file_stamps(temperatures_path):
+    """
+    Returns the path, size and modification time of every CSV file in the folder, keyed by file name,
+    which are used to tell whether a file has changed since results were saved from it
+    """
+    
+    with os.scandir(temperatures_path) as temperatures:
+        return {file.name: (file.path, file.stat().st_size, file.stat().st_mtime_ns)
+                for file in temperatures if file.name.endswith(".csv")}
+
+
+
+def update_aggregates(temperatures_path, output_folder, sketch_k=SKETCH_K):
+    """
+    Loads the aggregate state saved in aggregate_state.npz and merges in only the CSV files that have not been added to it yet.
+    The quantile sketches of every station and season, of size sketch_k, are saved and updated in the same way and kept under 'sketches'.
+    If a file that was already added has changed or been removed, its old values cannot be taken back out, so the state is rebuilt
+    from every file. The updated state is saved again and returned
+    """
+    
+    state_path = os.path.join(output_folder, 'aggregate_state.npz')
+    files = csv_file_stamps(temperatures_path)
+    rng = np.random.default_rng(SKETCH_SEED)
+
+    # Loads the saved state and sketches along with the name, size and modification time of every file already added to them.
+    # A state saved with sketches of another size is rebuilt, as sketches of different sizes cannot be merged
+    state, sketches, ingested = empty_aggregates(), empty_sketches(sketch_k), {}
+    if os.path.exists(state_path):
+        with np.load(state_path) as saved:
+            if int(saved['version']) == AGGREGATE_VERSION and 'sketch_k' in saved.files and int(saved['sketch_k']) == sketch_k:
+                state = {name: saved[name] for name in saved.files if not name.startswith(('version', 'file_', 'sketch_'))}
+                sketches = {name[len('sketch_'):]: saved[name] for name in saved.files if name.startswith('sketch_')}
+                ingested = {name: (int(size), int(mtime)) for name, size, mtime in zip(saved['file_names'], saved['file_sizes'], saved['file_mtimes'])}
+    if any(name not in files or files[name][1:] != stamp for name, stamp in ingested.items()):
+        state, sketches, ingested = empty_aggregates(), empty_sketches(sketch_k), {}
+
+    # Merges the partial state and sketches of every new file into the saved ones
+    for name in sorted(set(files) - set(ingested)):
+        path, size, mtime = files[name]
+        temperatures = read_temperature_file(path)
+        state = merge_aggregates(state, partial_aggregates(temperatures))
+        sketches = merge_sketches(sketches, partial_sketches(temperatures, sketch_k, rng), rng)
+        ingested[name] = (size, mtime)
+
+    # Saves the updated state and sketches along with the files that have been added to them
+    names = sorted(ingested)
+    np.savez(state_path, version=AGGREGATE_VERSION, **state,
+             **{f"sketch_{name}": values for name, values in sketches.items()},
+             file_names=np.array(names, dtype=str),
+             file_sizes=np.array([ingested[name][0] for name in names], dtype=np.int64),
+             file_mtimes=np.array([ingested[name][1] for name in names], dtype=np.int64))
+
+    # Returns the updated state with its sketches
+    state['sketches'] = sketches
+    return state
+
+
+
+def empty_sketches(k=SKETCH_K):
+    """
+    Returns a sketch state with no stations in it.
+    A sketch state holds a KLL quantile sketch for every station and season, which keeps a small weighted sample of the temperatures
+    so any quantile can be estimated with bounded memory. The values kept by every sketch are stored together in flat arrays, where
+    'sketch' gives the sketch of each value as station row*len(SEASONS) + season, and 'level' gives its level. A value in level h
+    stands for 2**h of the temperatures added, and 'count' holds the number of temperatures added to each sketch
+    """
+    
+    return {'k': k, 'station_ids': np.zeros(0, dtype=np.int64), 'stations': np.zeros(0, dtype=str),
+            'count': np.zeros((0, len(SEASONS)), dtype=np.int64), 'values': np.zeros(0),
+            'sketch': np.zeros(0, dtype=np.int64), 'level': np.zeros(0, dtype=np.int8)}
+
+
+
+def sketch_order(sketch, values):
+    """
+    Returns the order that sorts values by their sketch and then by value.
+    Ranking the values and then sorting one key made from the sketch and the rank is several times faster than np.lexsort
+    """
+    
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[np.argsort(values)] = np.arange(len(values))
+    return np.argsort(sketch*len(values) + ranks)
+
+
+
+def compress_sketches(sketches, rng):
+    """
+    Halves every level of every sketch that is over its capacity, working upwards as each level fills the one above it.
+    The top level of a sketch holds k values and every level below it holds two thirds as many as the one above.
+    A full level is sorted and every second value, starting from the first or second at random, is moved up a level.
+    Every sketch is compressed at once, level by level, and the sketch state is changed in place and returned
+    """
+    
+    k = int(sketches['k'])
+    sketch_count = sketches['count'].size
+    # The number of levels of each sketch
+    heights = np.ones(sketch_count, dtype=np.int64)
+    for level in range(1, int(sketches['level'].max(initial=0)) + 1):
+        heights[sketches['sketch'][sketches['level'] == level]] = level + 1
+
+    level = 0
+    while level < heights.max(initial=0):
+        at_level = sketches['level'] == level
+        level_counts = np.bincount(sketches['sketch'][at_level], minlength=sketch_count)
+        capacity = np.maximum(2, np.ceil(k*(2/3)**(heights - level - 1)))
+        over = level_counts > capacity
+        if over.any():
+            # Sorts the values of every full sketch at this level and numbers them from 0 within their sketch
+            rows = np.flatnonzero(at_level & over[sketches['sketch']])
+            rows = rows[sketch_order(sketches['sketch'][rows], sketches['values'][rows])]
+            sketch = sketches['sketch'][rows]
+            starts = np.flatnonzero(np.r_[True, sketch[1:] != sketch[:-1]])
+            rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+
+            # With an odd number of values the smallest one stays behind, so the total weight does not change
+            odd = level_counts[sketch] % 2
+            start = rng.integers(2, size=sketch_count)[sketch]
+            promoted = (rank >= odd) & ((rank - odd) % 2 == start)
+            dropped = (rank >= odd) & ~promoted
+            sketches['level'][rows[promoted]] = level + 1
+            keep = np.ones(len(sketches['values']), dtype=bool)
+            keep[rows[dropped]] = False
+            for name in ['values', 'sketch', 'level']:
+                sketches[name] = sketches[name][keep]
+            heights[over] = np.maximum(heights[over], level + 2)
+        level += 1
+
+    # Returns the compressed sketch state
+    return sketches
+
+
+
+def partial_sketches(temperatures, k=SKETCH_K, rng=None):
+    """
+    Builds the sketch state of a dataframe of temperatures, which can be one CSV file or part of one, with a quantile sketch of the monthly
+    temperatures of every station and season. States of different files can be merged using merge_sketches.
+    rng chooses which values are kept when a sketch is compressed, and the same one should be used for every state that is merged
+    """
+    
+    if rng is None:
+        rng = np.random.default_rng(SKETCH_SEED)
+    station_ids, first_rows, station_index = np.unique(temperatures['STN_ID'].to_numpy(), return_index=True, return_inverse=True)
+    values = temperatures[MONTHS].to_numpy(dtype=float)
+
+    # Every temperature goes into the bottom level of the sketch of its station and season, skipping NaN values
+    season_values = [values[:, [MONTHS.index(month) for month in months]] for months in SEASONS.values()]
+    season_sketches = [np.broadcast_to((station_index*len(SEASONS) + season)[:, None], season_values[season].shape)
+                       for season in range(len(SEASONS))]
+    valid = [~np.isnan(season_temps) for season_temps in season_values]
+
+    sketches = empty_sketches(k)
+    sketches['station_ids'] = station_ids
+    sketches['stations'] = np.asarray(temperatures['STATION_NAME'].to_numpy()[first_rows], dtype=str)
+    sketches['values'] = np.concatenate([season_temps[kept] for season_temps, kept in zip(season_values, valid)])
+    sketches['sketch'] = np.concatenate([sketch[kept] for sketch, kept in zip(season_sketches, valid)]).astype(np.int64)
+    sketches['level'] = np.zeros(len(sketches['values']), dtype=np.int8)
+    sketches['count'] = np.bincount(sketches['sketch'], minlength=len(station_ids)*len(SEASONS)).reshape(len(station_ids), len(SEASONS))
+
+    # Returns the compressed sketch state
+    return compress_sketches(sketches, rng)
+
+
+
+def merge_sketches(sketches_a, sketches_b, rng):
+    """
+    Merges two sketch states into one, matching their stations by STN_ID.
+    The levels of each pair of sketches are joined and the merged sketches are compressed
+    """
+    
+    if int(sketches_a['k']) != int(sketches_b['k']):
+        raise ValueError("Only sketches of the same size can be merged.")
+
+    # Lines up the stations of both states with the sorted list of all their station IDs
+    station_ids = np.union1d(sketches_a['station_ids'], sketches_b['station_ids'])
+    rows_a = np.searchsorted(station_ids, sketches_a['station_ids'])
+    rows_b = np.searchsorted(station_ids, sketches_b['station_ids'])
+
+    merged = empty_sketches(int(sketches_a['k']))
+    merged['station_ids'] = station_ids
+    merged['stations'] = np.zeros(len(station_ids), dtype=np.result_type(sketches_a['stations'], sketches_b['stations']))
+    merged['stations'][rows_b] = sketches_b['stations']
+    merged['stations'][rows_a] = sketches_a['stations']
+    merged['count'] = np.zeros((len(station_ids), len(SEASONS)), dtype=np.int64)
+    merged['count'][rows_a] += sketches_a['count']
+    merged['count'][rows_b] += sketches_b['count']
+
+    # Moves the values of both states to the sketches of their stations in the merged state.
+    # A state that has every station already has its sketches in the right place
+    moved = [sketches['sketch'] if len(rows) == len(station_ids) else rows[sketches['sketch'] // len(SEASONS)]*len(SEASONS) + sketches['sketch'] % len(SEASONS)
+             for sketches, rows in [(sketches_a, rows_a), (sketches_b, rows_b)]]
+    merged['values'] = np.concatenate([sketches_a['values'], sketches_b['values']])
+    merged['sketch'] = np.concatenate(moved)
+    merged['level'] = np.concatenate([sketches_a['level'], sketches_b['level']])
+
+    # Returns the compressed merged state
+    return compress_sketches(merged, rng)
+
+
+
+def sketch_quantiles(sketches, fractions):
+    """
+    Estimates each fraction of a quantile of every sketch at once. The values of each sketch are sorted with their weights,
+    and the first value whose running weight reaches the fraction of the sketch's count is taken.
+    Returns an array with a row for every station, a column for every season and the quantiles along the last axis
+    """
+    
+    fractions = np.asarray(fractions, dtype=float)
+    count = sketches['count'].ravel()
+    order = sketch_order(sketches['sketch'], sketches['values'])
+    values = sketches['values'][order]
+    sketch = sketches['sketch'][order]
+    weights = 2.0**sketches['level'][order]
+
+    # The running weight of every value within its own sketch
+    starts = np.searchsorted(sketch, np.arange(len(count)))
+    ends = np.searchsorted(sketch, np.arange(len(count)), side='right')
+    cumulative = np.cumsum(weights)
+    cumulative -= np.repeat(np.r_[0.0, cumulative][starts], ends - starts)
+
+    # Counts the values of each sketch whose running weight is below each fraction, giving the position of the quantile
+    quantiles = np.full((len(count), len(fractions)), np.nan)
+    filled = count > 0
+    for number, fraction in enumerate(fractions):
+        below = np.bincount(sketch, weights=cumulative < fraction*count[sketch], minlength=len(count)).astype(np.int64)
+        positions = np.minimum(starts + below, ends - 1)
+        quantiles[filled, number] = values[positions[filled]]
+    return quantiles.reshape(sketches['count'].shape + (len(fractions),))
+
+
+
+def stream_aggregates(temperatures_path=None, chunk_rows=CHUNK_ROWS, sketch_k=None):
+    """
+    Reads every CSV file in chunks of chunk_rows rows and merges the aggregate state of each chunk into one state.
+    Only one chunk and the per-station totals are held in memory at a time, so archives larger than the memory can be analysed.
+    If sketch_k is given, quantile sketches of every station and season are built in the same pass and kept under 'sketches'
+    """
+    
+    if temperatures_path is None:
+        temperatures_path = find_temperatures_folder()
+
+    state = empty_aggregates()
+    if sketch_k is not None:
+        sketches = empty_sketches(sketch_k)
+        rng = np.random.default_rng(SKETCH_SEED)
+    for file_name in sorted(os.listdir(temperatures_path)):
+        if file_name.endswith(".csv"):
+            with pd.read_csv(os.path.join(temperatures_path, file_name), usecols=list(CSV_DTYPES), dtype=CSV_DTYPES, chunksize=chunk_rows) as chunks:
+                for chunk in chunks:
+                    state = merge_aggregates(state, partial_aggregates(chunk))
+                    if sketch_k is not None:
+                        sketches = merge_sketches(sketches, partial_sketches(chunk, sketch_k, rng), rng)
+    if sketch_k is not None:
+        state['sketches'] = sketches
+
+    # Returns the state of every file along with the folder path
+    return state, temperatures_path
+
+
+
+def aggregate_reports(state, top_k=1):
+    """
+    Works out the seasonal averages, the stations with the largest temperature range and the most stable and most variable stations
+    from an aggregate state, giving the same results as calculate_averages, calculate_largest_temp_range and calculate_most_stable_temperature
+    """
+    
+    # The average of each month across every station, then the average of the months in each season
+    with np.errstate(invalid='ignore', divide='ignore'):
+        month_avgs = dict(zip(MONTHS, state['month_sum'].sum(axis=0)/state['month_count'].sum(axis=0)))
+        std_devs = np.where(state['count'] > 1, np.sqrt(state['m2']/(state['count'] - 1)), np.nan)
+    averages = {season: np.nanmean([month_avgs[month] for month in months]) for season, months in SEASONS.items()}
+
+    stations = state['stations'].tolist()
+    return averages, largest_ranges(stations, state['min'], state['max'], top_k), most_stable_and_variable(stations, std_devs, top_k)
+    
+    
+
+def station_states(station_ids):
+    """
+    Returns the state of every station worked out from its station number, or an empty string if the number is not in any state
+    """
+    
+    prefixes = np.asarray(station_ids, dtype=np.int64)//1000
+    limits = np.array([limit for limit, state in STATE_PREFIXES])
+    names = np.array([state for limit, state in STATE_PREFIXES] + [''])
+    positions = np.searchsorted(limits, prefixes)
+    positions[prefixes < 1] = len(STATE_PREFIXES)
+    return names[positions]
+
+
+
+def build_season_cube(station_temps):
+    """
+    Builds a cube with the sum, count, minimum and maximum temperature of every station, year and season.
+    Each season uses the months of the same year, as in calculate_averages, so any breakdown by station, year, season or state
+    can be worked out from the cube without reading the CSV files again
+    """
+    
+    temps = station_temps['temps']
+    cube = {'station_ids': np.asarray(station_temps['station_ids']),
+            'stations': np.asarray(station_temps['stations'], dtype=str),
+            'states': station_states(station_temps['station_ids']),
+            'years': np.asarray(station_temps['years']),
+            'seasons': np.array(list(SEASONS), dtype=str)}
+
+    # Takes the three months of each season from the array and reduces them at once, giving arrays of station x year x season.
+    # fmin and fmax skip NaN values without warnings, so a season with no temperatures is left as NaN
+    season_temps = np.stack([temps[:, :, [MONTHS.index(month) for month in months]] for months in SEASONS.values()], axis=2)
+    valid = ~np.isnan(season_temps)
+    cube['sum'] = np.where(valid, season_temps, 0.0).sum(axis=3)
+    cube['count'] = valid.sum(axis=3).astype(np.int32)
+    cube['min'] = np.fmin.reduce(season_temps, axis=3)
+    cube['max'] = np.fmax.reduce(season_temps, axis=3)
+
+    # Returns the cube
+    return cube
+
+
+
+def load_season_cube(temperatures_path, output_folder):
+    """
+    Loads the cube saved in season_cube.npz if it was built from the CSV files as they are now,
+    otherwise builds it again from the CSV files and saves it
+    """
+    
+    cube_path = os.path.join(output_folder, 'season_cube.npz')
+    files = csv_file_stamps(temperatures_path)
+    names = sorted(files)
+    stamps = np.array([files[name][1:] for name in names], dtype=np.int64).reshape(-1, 2)
+
+    # The saved cube is only used if the version and the name, size and modification time of every file are the same
+    if os.path.exists(cube_path):
+        with np.load(cube_path) as saved:
+            if (int(saved['version']) == CUBE_VERSION and saved['file_names'].tolist() == names
+                    and np.array_equal(saved['file_stamps'], stamps)):
+                return {name: saved[name] for name in saved.files if name not in ('version', 'file_names', 'file_stamps')}
+
+    cube = build_season_cube(extract_station_temperatures(dataframe_concat(temperatures_path)[0]))
+    np.savez(cube_path, version=CUBE_VERSION, file_names=np.array(names, dtype=str), file_stamps=stamps, **cube)
+
+    # Returns the new cube
+    return cube
+
+
+
+def rollup_season_cube(cube, by):
+    """
+    Adds up the cube into one row per year, station or state, or a single row for everything, with one column per season.
+    Returns the labels of the rows and the average, minimum, maximum and number of temperatures of every row and season
+    """
+    
+    if by == 'year':
+        labels = cube['years'].tolist()
+        sums, counts = cube['sum'].sum(axis=0), cube['count'].sum(axis=0)
+        mins, maxs = np.fmin.reduce(cube['min'], axis=0), np.fmax.reduce(cube['max'], axis=0)
+    elif by == 'station':
+        labels = cube['stations'].tolist()
+        sums, counts = cube['sum'].sum(axis=1), cube['count'].sum(axis=1)
+        mins, maxs = np.fmin.reduce(cube['min'], axis=1), np.fmax.reduce(cube['max'], axis=1)
+    elif by == 'state':
+        # The stations of each state are added together, with the states in the order of STATE_PREFIXES
+        order = [state for limit, state in STATE_PREFIXES] + ['']
+        labels = [state for state in order if state in set(cube['states'].tolist())]
+        state_index = np.array([labels.index(state) for state in cube['states'].tolist()], dtype=np.int64)
+        sums = np.zeros((len(labels), len(SEASONS)))
+        counts = np.zeros((len(labels), len(SEASONS)), dtype=np.int64)
+        mins = np.full((len(labels), len(SEASONS)), np.nan)
+        maxs = np.full((len(labels), len(SEASONS)), np.nan)
+        np.add.at(sums, state_index, cube['sum'].sum(axis=1))
+        np.add.at(counts, state_index, cube['count'].sum(axis=1))
+        np.fmin.at(mins, state_index, np.fmin.reduce(cube['min'], axis=1))
+        np.fmax.at(maxs, state_index, np.fmax.reduce(cube['max'], axis=1))
+        labels = [state or 'Unknown' for state in labels]
+    elif by == 'all':
+        labels = ['All stations']
+        sums, counts = cube['sum'].sum(axis=(0, 1))[None], cube['count'].sum(axis=(0, 1))[None]
+        mins, maxs = np.fmin.reduce(cube['min'], axis=(0, 1))[None], np.fmax.reduce(cube['max'], axis=(0, 1))[None]
+    else:
+        raise ValueError(f"Cannot add up the cube by '{by}'.")
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums/counts, np.nan)
+
+    # Returns the roll up
+    return {'labels': labels, 'seasons': cube['seasons'].tolist(), 'mean': means, 'min': mins, 'max': maxs, 'count': counts}
+
+
+
+def write_rollup(output_folder, rollup, by):
+    """
+    Writes the seasonal averages, minimums and maximums of every row of a roll up to seasonal_by_<by>.txt and returns the path to the file
+    """
+    
+    rollup_file = os.path.join(output_folder, f"seasonal_by_{by}.txt")
+    with open(rollup_file, 'w') as file:
+        for row, label in enumerate(rollup['labels']):
+            seasons = [f"{season} {rollup['mean'][row, column]:.1f}°C (Max: {rollup['max'][row, column]:.1f}°C, Min: {rollup['min'][row, column]:.1f}°C)"
+                       for column, season in enumerate(rollup['seasons'])]
+            file.write(f"{label}: {', '.join(seasons)}\n")
+    return rollup_file
+
+
+
+def calculate_station_trends(station_temps, min_years=3):
+    """
+    Fits a straight line to the yearly average of every station and season at once and returns the slope in °C per decade,
+    the R² of the fit and the number of years used. Years with no temperatures are left out of the fit through a mask,
+    and stations with fewer than min_years years of a season get NaN for that season
+    """
+    
+    # The yearly average of every station and season comes from the sums and counts of the season cube
+    cube = build_season_cube(station_temps)
+    used = cube['count'] > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(used, cube['sum']/cube['count'], 0.0)
+
+    # The years are centred on their middle so the sums of squares stay small, which does not change the slope
+    years = cube['years'].astype(float)
+    x = (years - years.mean())[None, :, None]
+    weights = used.astype(float)
+
+    # The masked sums of the least squares fit for every station and season, each an array of station x season
+    n = weights.sum(axis=1)
+    sum_x = (weights*x).sum(axis=1)
+    sum_y = means.sum(axis=1)
+    sum_xx = (weights*x**2).sum(axis=1)
+    sum_xy = (means*x).sum(axis=1)
+    sum_yy = (means**2).sum(axis=1)
+
+    spread_x = n*sum_xx - sum_x**2
+    spread_y = n*sum_yy - sum_y**2
+    covariance = n*sum_xy - sum_x*sum_y
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = np.where((n >= min_years) & (spread_x > 0), covariance/spread_x, np.nan)
+        # A season with the same average every year fits perfectly
+        r_squared = np.where(spread_y > 0, covariance**2/(spread_x*spread_y), 1.0)
+    r_squared = np.where(np.isnan(slopes), np.nan, r_squared)
+
+    # Returns the trends of every station and season
+    return {'stations': list(station_temps['stations']), 'seasons': list(SEASONS),
+            'slope': slopes*10, 'r_squared': r_squared, 'years': n.astype(int)}
+
+
+
+def write_trends(output_folder, trends):
+    """
+    Writes the trend of every station and season to station_trends.txt and returns the path to the file
+    """
+    
+    trends_file = os.path.join(output_folder, 'station_trends.txt')
+    with open(trends_file, 'w') as file:
+        for row, station in enumerate(trends['stations']):
+            seasons = [f"{season} {trends['slope'][row, column]:+.2f}°C/decade (R²: {trends['r_squared'][row, column]:.2f})"
+                       for column, season in enumerate(trends['seasons'])]
+            file.write(f"{station}: {', '.join(seasons)}\n")
+    return trends_file
+
+
+
+def write_percentiles(output_folder, sketches):
+    """
+    Writes the percentiles in PERCENTILES of every station and season, estimated from their quantile sketches,
+    to temperature_percentiles.txt and returns the path to the file
+    """
+    
+    percentiles_file = os.path.join(output_folder, 'temperature_percentiles.txt')
+    quantiles = sketch_quantiles(sketches, np.array(PERCENTILES)/100)
+    with open(percentiles_file, 'w') as file:
+        # The stations are already sorted by STN_ID
+        for name, values in zip(sketches['stations'].tolist(), quantiles.tolist()):
+            columns = [f"{season} ({', '.join(f'P{percentile}: {value:.1f}°C' for percentile, value in zip(PERCENTILES, season_values))})"
+                       for season, season_values in zip(SEASONS, values)]
+            file.write(f"{name}: {', '.join(columns)}\n")
+    return percentiles_file
+
+
+
+def write_reports(output_folder, averages, highest_ranges, most_stable_variable):
+    """
+    Writes the seasonal averages, the largest temperature ranges and the most stable and most variable stations to their text files
+    and returns the paths to the three files
+    """
 
     # Writes the average temperatures to a text file
     avg_file = os.path.join(output_folder, 'average_temp.txt')
     with open(avg_file, 'w') as file:
-        averages = calculate_averages(all_temperatures)
         for season, avg in averages.items():
             file.write(f"{season}: {avg:.1f}°C\n")
     
@@ -180,21 +1203,151 @@ def main():
     # Writes the largest temperature ranges to a text file        
     range_file = os.path.join(output_folder, 'largest_temp_range_station.txt')
     with open(range_file, 'w') as file:
-        highest_ranges = calculate_largest_temp_range(all_temps_per_station)
-        for station, values in highest_ranges.items():
-            file.write(f"{station}: Range {values['range']:.1f}°C (Max: {values['max']:.1f}°C, Min: {values['min']:.1f}°C)\n")
+        for values in highest_ranges:
+            file.write(f"{values['station']}: Range {values['range']:.1f}°C (Max: {values['max']:.1f}°C, Min: {values['min']:.1f}°C)\n")
             
             
     # Writes the most stable and most variable temperatures to a text file
     stability_file = os.path.join(output_folder, 'temperature_stability_stations.txt')
     with open(stability_file, 'w') as file:
-        most_stable_variable = calculate_most_stable_temperature(all_temps_per_station)
-        for stability, values in most_stable_variable.items():
-            file.write(f"{stability}: Station {values['station']}: StdDev {values['std_dev']:.1f}°C\n")
+        for stability, stations in most_stable_variable.items():
+            for values in stations:
+                file.write(f"{stability}: Station {values['station']}: StdDev {values['std_dev']:.1f}°C\n")
+
+    # Returns the paths to the three files
+    return [avg_file, range_file, stability_file]
+
+
+
+def parse_arguments(argv=None):
+    """
+    Reads the command line arguments that choose how the temperatures are analysed
+    """
+    
+    parser = argparse.ArgumentParser(description="Analyse the temperatures recorded by weather stations.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only read CSV files added since the last run, updating the totals saved in aggregate_state.npz")
+    parser.add_argument('--stream', action='store_true',
+                        help="read the CSV files in chunks in a single pass instead of loading every file into memory")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help="number of rows read at a time when streaming (default: %(default)s)")
+    parser.add_argument('--sketch-k', type=int, default=SKETCH_K,
+                        help="size of the quantile sketches used for temperature_percentiles.txt, larger is more accurate (default: %(default)s)")
+    parser.add_argument('--top-k', type=int, default=1,
+                        help="number of stations reported for the largest range and for the most stable and most variable, ties included (default: %(default)s)")
+
+    # The query command looks up the temperatures of one station between two months instead of writing the text files
+    commands = parser.add_subparsers(dest='command')
+    query = commands.add_parser('query', help="show the temperatures of a station between two months")
+    query.add_argument('station', help="STN_ID or name of the station")
+    query.add_argument('start', help="first month of the period, written as YYYY-MM")
+    query.add_argument('end', help="last month of the period, written as YYYY-MM")
+
+    # The region command works out the results for only the stations near a point or inside a box
+    region = commands.add_parser('region', help="show the results for the stations near a point or inside a box")
+    area = region.add_mutually_exclusive_group(required=True)
+    area.add_argument('--near', nargs=2, type=float, metavar=('LAT', 'LON'), help="point the stations must be near")
+    area.add_argument('--box', nargs=4, type=float, metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'), help="box the stations must be inside")
+    region.add_argument('--radius', type=float, default=300.0, help="distance from the point in kilometres (default: %(default)s)")
+
+    # The cube command writes seasonal breakdowns from the saved station x year x season cube
+    cube = commands.add_parser('cube', help="write the seasonal temperatures of every year, station or state from the season cube")
+    cube.add_argument('--by', choices=['year', 'station', 'state', 'all'], default='year', help="what each line of the report is for (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    """
+    The main function that reads data from CSV files, analyses it, then writes the results to text files
+    """
+
+    args = parse_arguments(argv)
+
+    if args.command == 'query':
+        # Builds the range index from every CSV file and prints the results of the query
+        range_index = build_range_index(extract_station_temperatures(dataframe_concat()[0]))
+        try:
+            result = query_range(range_index, args.station, args.start, args.end)
+        except ValueError as error:
+            print(error)
+            return
+        print(f"{result['station']} from {result['start']} to {result['end']}: {result['count']} months")
+        if result['count'] == 0:
+            print("No temperatures were recorded for the station in this period.")
+            return
+        print(f"Mean: {result['mean']:.1f}°C, StdDev: {result['std_dev']:.1f}°C, Max: {result['max']:.1f}°C, Min: {result['min']:.1f}°C")
+        return
+
+    if args.command == 'cube':
+        # Loads the cube, building it only if the CSV files have changed, and writes the roll up to a text file
+        temperatures_path = find_temperatures_folder()
+        output_folder = os.path.dirname(temperatures_path)
+        rollup_file = write_rollup(output_folder, rollup_season_cube(load_season_cube(temperatures_path, output_folder), args.by), args.by)
+        print(f"Results successfully written to {os.path.basename(rollup_file)}!")
+        return
+
+    if args.command == 'region':
+        # Finds the stations in the region with the spatial index and works out the results for only those stations
+        all_temps_per_station = extract_station_temperatures(dataframe_concat()[0])
+        spatial_index = build_spatial_index(all_temps_per_station)
+        try:
+            if args.near:
+                rows = stations_within_radius(spatial_index, args.near[0], args.near[1], args.radius)
+            else:
+                rows = stations_in_box(spatial_index, *args.box)
+        except ValueError as error:
+            print(error)
+            return
+        if len(rows) == 0:
+            print("No stations were found in the region.")
+            return
+        region_temps = select_stations(all_temps_per_station, rows)
+        print(f"{len(rows)} stations: {', '.join(region_temps['stations'])}")
+        for season, avg in calculate_averages(region_temps).items():
+            print(f"{season}: {avg:.1f}°C")
+        for values in calculate_largest_temp_range(region_temps, args.top_k):
+            print(f"Largest range: {values['station']}: Range {values['range']:.1f}°C (Max: {values['max']:.1f}°C, Min: {values['min']:.1f}°C)")
+        for stability, stations in calculate_most_stable_temperature(region_temps, args.top_k).items():
+            for values in stations:
+                print(f"{stability}: Station {values['station']}: StdDev {values['std_dev']:.1f}°C")
+        return
+
+    if args.incremental:
+        # Merges any new CSV files into the saved aggregate state and works out the results from it
+        temperatures_path = find_temperatures_folder()
+        output_folder = os.path.dirname(temperatures_path)
+        state = update_aggregates(temperatures_path, output_folder, args.sketch_k)
+        averages, highest_ranges, most_stable_variable = aggregate_reports(state, args.top_k)
+    elif args.stream:
+        # Streams every CSV file in chunks and works out the results from the merged totals
+        state, temperatures_path = stream_aggregates(chunk_rows=args.chunk_rows, sketch_k=args.sketch_k)
+        output_folder = os.path.dirname(temperatures_path)
+        averages, highest_ranges, most_stable_variable = aggregate_reports(state, args.top_k)
+    else:
+        # Assigns the concatenated dataframe and folder path to variables
+        all_temperatures, temperatures_path = dataframe_concat()
+        # Assigns the station names and their temperatures for every year and month, as a single array, to a dictionary
+        all_temps_per_station = extract_station_temperatures(all_temperatures)
+
+        # Determines the parent folder of the 'temperatures' folder so the output files are saved there
+        output_folder = os.path.dirname(temperatures_path)
+
+        averages = calculate_averages(all_temps_per_station)
+        highest_ranges = calculate_largest_temp_range(all_temps_per_station, args.top_k)
+        most_stable_variable = calculate_most_stable_temperature(all_temps_per_station, args.top_k)
 
+    # Writes the results to the three text files, the trends of every station when the yearly temperatures were loaded,
+    # and the percentiles of every station
+    report_files = write_reports(output_folder, averages, highest_ranges, most_stable_variable)
+    if not (args.incremental or args.stream):
+        report_files.append(write_trends(output_folder, calculate_station_trends(all_temps_per_station)))
+        report_files.append(write_percentiles(output_folder, partial_sketches(all_temperatures, args.sketch_k)))
+    else:
+        report_files.append(write_percentiles(output_folder, state['sketches']))
 
     # Checks if all three files exist before printing success message
-    if all(os.path.exists(f) for f in [avg_file, range_file, stability_file]):
+    if all(os.path.exists(f) for f in report_files):
         print(f"Results successfully written to files!")    
 
 
@@ -0,0 +1,191 @@
+'''
+
+Group Name: DAN/EXT 28
+
+Group Members:
+FATEEN RAHMAN - s387983
+HENDRICK DANG (VAN HOI DANG)- s395598
+KEVIN ZHU (JIAWEI ZHU) - s387035
+MEHRAAB FERDOUSE - s393148
+
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import HIT137_DANEXT28_A2_Q2 as analysis
+
+
+
+# The stages of the analysis that are benchmarked, in the order they are run.
+# Each stage uses the results of the stages before it, which are kept in a dictionary
+STAGES = {
+    'dataframe_concat': lambda results: {'df': analysis.dataframe_concat(results['path'], use_cache=False)[0]},
+    'dataframe_concat_cached': lambda results: {'df': analysis.dataframe_concat(results['path'], use_cache=True)[0]},
+    'extract_station_temperatures': lambda results: {'station_temps': analysis.extract_station_temperatures(results['df'])},
+    'calculate_averages': lambda results: {'averages': analysis.calculate_averages(results['station_temps'])},
+    'calculate_largest_temp_range': lambda results: {'ranges': analysis.calculate_largest_temp_range(results['station_temps'])},
+    'calculate_most_stable_temperature': lambda results: {'stability': analysis.calculate_most_stable_temperature(results['station_temps'])},
+    'calculate_station_trends': lambda results: {'trends': analysis.calculate_station_trends(results['station_temps'])},
+    'partial_sketches': lambda results: {'sketches': analysis.partial_sketches(results['df'])},
+    'sketch_quantiles': lambda results: {'quantiles': analysis.sketch_quantiles(results['sketches'], np.array(analysis.PERCENTILES)/100)},
+    'stream_aggregates': lambda results: {'state': analysis.stream_aggregates(results['path'], sketch_k=analysis.SKETCH_K)[0]},
+}
+
+# The area that the synthetic stations are placed in, roughly the mainland of Australia and Tasmania
+LAT_RANGE = (-43.5, -10.5)
+LON_RANGE = (113.0, 154.0)
+
+
+
+def generate_archive(folder, stations, years, first_year=1986, missing=0.0, seed=137):
+    """
+    Writes one stations_group_YYYY.csv file per year into the folder, each with a row of monthly temperatures for every station.
+    Temperatures follow a seasonal curve that peaks in January, is warmer and flatter towards the equator, and has a small
+    warming trend and random noise. A fraction of the rows, given by missing, is left out of each file at random.
+    Returns the total number of rows and bytes written
+    """
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    # Every station gets a unique station number with a real state prefix, a name and a position
+    station_ids = np.sort(rng.choice(np.arange(1000, 100000), size=stations, replace=False))
+    names = np.array([f"SYNTHETIC-STATION-{number:06d}" for number in station_ids])
+    lats = np.round(rng.uniform(*LAT_RANGE, size=stations), 2)
+    lons = np.round(rng.uniform(*LON_RANGE, size=stations), 2)
+
+    # Stations nearer the equator are warmer on average and change less between summer and winter
+    warmth = 1 - (lats - LAT_RANGE[0])/(LAT_RANGE[1] - LAT_RANGE[0])
+    base = 20 + 14*warmth + rng.normal(0, 1.5, size=stations)
+    amplitude = 8 - 5*warmth + rng.normal(0, 0.5, size=stations)
+    seasonal_curve = np.cos(2*np.pi*np.arange(12)/12)
+
+    rows = 0
+    total_bytes = 0
+    for year_number in range(years):
+        year = first_year + year_number
+        temps = (base[:, None] + amplitude[:, None]*seasonal_curve[None, :] + 0.02*year_number
+                 + rng.normal(0, 1.0, size=(stations, 12)))
+        kept = rng.random(stations) >= missing
+
+        frame = pd.DataFrame({'STATION_NAME': names[kept], 'STN_ID': station_ids[kept], 'LAT': lats[kept], 'LON': lons[kept]})
+        for month_number, month in enumerate(analysis.MONTHS):
+            frame[month] = np.round(temps[kept, month_number], 2)
+        path = os.path.join(folder, f"stations_group_{year}.csv")
+        frame.to_csv(path, index=False)
+
+        rows += int(kept.sum())
+        total_bytes += os.path.getsize(path)
+
+    # Returns the number of rows and bytes written
+    return rows, total_bytes
+
+
+
+def run_stage(stage, results, trace_memory):
+    """
+    Runs one stage of the analysis and returns its results, how long it took in seconds and,
+    if trace_memory is True, the peak memory allocated while it ran in bytes (otherwise None)
+    """
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    stage_results = STAGES[stage](results)
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # Returns the results, the time taken and the peak memory
+    return stage_results, seconds, peak
+
+
+
+def benchmark_archive(archive_name, path, trace_memory=True):
+    """
+    Runs every stage of the analysis on one archive.
+    Each stage is timed without memory tracing, and then run again under tracemalloc to find its peak memory,
+    as tracing slows the program down too much for the timings to be fair
+    """
+
+    benchmark_results = []
+    results = {'path': path}
+    # Builds the cache of the archive first, so dataframe_concat_cached times loading the cache rather than saving it
+    analysis.dataframe_concat(path, use_cache=True)
+    for stage in STAGES:
+        stage_results, seconds, _ = run_stage(stage, results, False)
+        peak = run_stage(stage, results, True)[2] if trace_memory else None
+        results.update(stage_results)
+        benchmark_results.append({'archive': archive_name, 'stage': stage, 'seconds': seconds, 'peak_memory_bytes': peak})
+        print(f"{archive_name}: {stage} took {seconds:.3f} s")
+
+    # Returns the results for this archive
+    return benchmark_results
+
+
+
+def git_revision():
+    """
+    Returns the current git commit of the repository, or None if it cannot be found
+    """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def main():
+    """
+    The main function that generates the archives, runs the benchmarks and saves the results to a JSON file
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmark the temperature analysis on synthetic archives.")
+    parser.add_argument('--stations', type=int, nargs='+', default=[112, 1000, 10000], help="numbers of stations in each archive")
+    parser.add_argument('--years', type=int, nargs='+', default=[20], help="numbers of years in each archive")
+    parser.add_argument('--missing', type=float, default=0.0, help="fraction of the rows left out of each file at random")
+    parser.add_argument('--keep', help="folder to keep the generated archives in, instead of deleting them")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc runs used to measure peak memory")
+    parser.add_argument('--output', default='analysis_benchmark.json', help="file the results are written to")
+    args = parser.parse_args()
+
+    archives = []
+    results = []
+    with tempfile.TemporaryDirectory() as work_folder:
+        for stations in args.stations:
+            for years in args.years:
+                archive_name = f"{stations}x{years}"
+                # Each archive gets its own 'temperatures' folder so its cache is kept next to it
+                path = os.path.join(args.keep or work_folder, archive_name, 'temperatures')
+                rows, csv_bytes = generate_archive(path, stations, years, missing=args.missing)
+                archives.append({'name': archive_name, 'stations': stations, 'years': years, 'rows': rows, 'csv_bytes': csv_bytes})
+                results.extend(benchmark_archive(archive_name, path, not args.no_memory))
+
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump({'revision': git_revision(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'pandas': pd.__version__,
+                   'missing': args.missing,
+                   'archives': archives,
+                   'results': results}, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,49 @@ MEHRAAB FERDOUSE - s393148
 
 '''
 
-import turtle
+import argparse
+import struct
+import zlib
+
+import numpy as np
+
+
+
+# Multiplying by this complex number turns a direction 60° to the left, the turn made at the start of the triangle on each edge
+PEAK_TURN = np.exp(1j*np.pi/3)
+
+# The turn made before each of the four smaller segments of an edge, in multiples of 60° to the left:
+# straight, left 60°, right 120° (giving -60°) and left 60° (back to straight)
+DIGIT_TURNS = [0, 1, -1, 0]
+
+# The directions of a segment turned by each multiple of 60°
+SIXTH_TURNS = PEAK_TURN**np.arange(6)
+
+# The deepest levels of every edge are calculated at once with edge_vertices() from a template of 4**TEMPLATE_DEPTH points,
+# and only the levels above it are walked one segment at a time
+TEMPLATE_DEPTH = 8
+
+# The number of points handled at a time when streaming, drawing or exporting, so a deep pattern is never held in memory
+EXPORT_CHUNK = 1 << 16
+
+# The space left around the pattern in exported files, and the width of the line, matching the turtle pen size
+EXPORT_MARGIN = 10
+LINE_WIDTH = 2
+
+# The turtle module, which is only imported by load_turtle() when a window is drawn,
+# as importing it loads tkinter, which is not needed to export the pattern to files
+turtle = None
+
+
+
+def load_turtle():
+    """
+    Imports the turtle module the first time a window is drawn
+    """
+
+    global turtle
+    if turtle is None:
+        import turtle
 
 
 
@@ -51,6 +93,8 @@ def draw_pattern(sides, length, depth):
     created by the draw_edge() function
     """
     
+    load_turtle()
+
     # Calculates the angle to turn at each corner of the pattern
     angle = 360 / sides
 
@@ -68,6 +112,280 @@ def draw_pattern(sides, length, depth):
 
 
 
+def edge_vertices(length, depth):
+    """
+    Calculates every point of one fractal edge, in the order draw_edge() visits them, without drawing anything.
+    Points are complex numbers (x + yj) with the edge going from 0 to length along the x axis.
+    Instead of recursing, each depth replaces every segment with its four smaller segments in one NumPy step
+    """
+    
+    # Depth 0 is a single straight segment
+    points = np.array([0, length], dtype=complex)
+    for _ in range(depth):
+        starts = points[:-1]
+        thirds = (points[1:] - starts) / 3
+        # Every segment becomes four, so each old point is followed by three new points
+        new_points = np.empty(4*len(starts) + 1, dtype=complex)
+        new_points[0:-1:4] = starts
+        # The end of the first 1/3 segment
+        new_points[1::4] = starts + thirds
+        # The tip of the triangle, reached by turning left 60° and drawing another 1/3 segment
+        new_points[2::4] = starts + thirds + thirds*PEAK_TURN
+        # The end of the third 1/3 segment, two thirds along the old segment
+        new_points[3::4] = starts + 2*thirds
+        new_points[-1] = points[-1]
+        points = new_points
+
+    # Returns the points of the edge
+    return points
+
+
+
+def segment_turns(depth):
+    """
+    Yields the direction of every segment of an edge of the given depth, in the order they are drawn, as a multiple of 60° to the left.
+    The segments are counted like an odometer with one base 4 digit per depth, where each digit picks one of the four smaller segments,
+    so only a stack of depth digits and the turns they add up to is kept instead of the recursion of draw_edge()
+    """
+    
+    digits = [0]*depth
+    # turns[level] is the total turn of the digits above that level
+    turns = [0]*(depth + 1)
+    while True:
+        yield turns[depth]
+
+        # Moves the odometer on by one, resetting every digit that was at 3 and carrying into the digit above it
+        level = depth - 1
+        while level >= 0 and digits[level] == 3:
+            digits[level] = 0
+            level -= 1
+        if level < 0:
+            return
+        digits[level] += 1
+        for below in range(level, depth):
+            turns[below + 1] = turns[below] + DIGIT_TURNS[digits[below]]
+
+
+
+def iter_vertex_chunks(sides, length, depth, start=None, chunk_size=EXPORT_CHUNK):
+    """
+    Yields the points of the whole pattern in the order draw_pattern() draws them, as arrays of about chunk_size points,
+    without ever calculating the whole pattern. The top levels of every edge are walked with segment_turns(), and each of their
+    segments is filled in from a template of the deepest TEMPLATE_DEPTH levels, so the memory used does not grow with the depth
+    """
+    
+    if start is None:
+        start = complex(-length/2, -length/2)
+    bottom = min(depth, TEMPLATE_DEPTH)
+    segment_length = length / 3**(depth - bottom)
+    # The points of one top level segment facing east, leaving out its last point as it is the first point of the next segment
+    template = edge_vertices(segment_length, bottom)[:-1]
+
+    position = start
+    pieces, pieces_size = [], 0
+    for side in range(sides):
+        side_turn = np.exp(1j*np.radians(360/sides*side))
+        for turn in segment_turns(depth - bottom):
+            direction = side_turn*SIXTH_TURNS[turn % 6]
+            pieces.append(position + direction*template)
+            pieces_size += len(template)
+            position = position + direction*segment_length
+            # Joins the segments into one array once there are enough points
+            if pieces_size >= chunk_size:
+                yield np.concatenate(pieces)
+                pieces, pieces_size = [], 0
+
+    # The last chunk ends with the point the pattern finishes on
+    pieces.append(np.array([position]))
+    yield np.concatenate(pieces)
+
+
+
+def iter_vertices(sides, length, depth, start=None):
+    """
+    Yields the points of the whole pattern one at a time as complex numbers (x + yj), in the order draw_pattern() draws them
+    """
+    
+    for chunk in iter_vertex_chunks(sides, length, depth, start):
+        yield from chunk.tolist()
+
+
+
+def pattern_statistics(chunks):
+    """
+    Works out the number of points, the total length of the line and the bounding box (x_min, y_min, x_max, y_max)
+    of a pattern from an iterable of point arrays, looking at one array at a time
+    """
+    
+    count = 0
+    total_length = 0.0
+    x_min = y_min = np.inf
+    x_max = y_max = -np.inf
+    previous = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        # The segment joining the last point of the chunk before to the first point of this one is counted as well
+        joined = chunk if previous is None else np.concatenate([[previous], chunk])
+        total_length += np.abs(np.diff(joined)).sum()
+        count += len(chunk)
+        x_min, x_max = min(x_min, chunk.real.min()), max(x_max, chunk.real.max())
+        y_min, y_max = min(y_min, chunk.imag.min()), max(y_max, chunk.imag.max())
+        previous = chunk[-1]
+    return {'vertices': count, 'length': total_length, 'bounds': (x_min, y_min, x_max, y_max)}
+
+
+
+def draw_polyline(chunks):
+    """
+    Draws the pattern directly on the turtle canvas as one line for each array of points in chunks,
+    which is much faster than moving the turtle along every segment
+    """
+    
+    canvas = turtle.getcanvas()
+    previous = None
+    for chunk in chunks:
+        # Each line starts at the last point of the line before, so the lines join up
+        if previous is not None:
+            chunk = np.concatenate([[previous], chunk])
+        # The canvas has its y axis pointing down, so the y coordinates are flipped
+        coordinates = np.empty(2*len(chunk))
+        coordinates[0::2] = chunk.real
+        coordinates[1::2] = -chunk.imag
+        if len(chunk) > 1:
+            canvas.create_line(coordinates.tolist(), width=LINE_WIDTH, fill='black')
+        previous = chunk[-1]
+
+    # Hides the turtle after drawing is complete
+    turtle.hideturtle()
+    # Finishes the drawing and displays the window
+    turtle.done()
+
+
+
+def export_svg(path, chunks, bounds):
+    """
+    Writes the pattern to an SVG file as a single path through the points in chunks, an iterable of point arrays.
+    Each chunk is written to the file as soon as it is formatted, so only one chunk is ever held in memory
+    """
+    
+    x_min, y_min, x_max, y_max = bounds
+    width = x_max - x_min + 2*EXPORT_MARGIN
+    height = y_max - y_min + 2*EXPORT_MARGIN
+
+    with open(path, 'w', encoding='utf-8') as file:
+        # SVG has its y axis pointing down, so the y coordinates are flipped and the view starts at the top of the pattern
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        file.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" '
+                   f'viewBox="{x_min - EXPORT_MARGIN:.3f} {-y_max - EXPORT_MARGIN:.3f} {width:.3f} {height:.3f}">\n')
+        file.write(f'<rect x="{x_min - EXPORT_MARGIN:.3f}" y="{-y_max - EXPORT_MARGIN:.3f}" width="{width:.3f}" height="{height:.3f}" fill="white"/>\n')
+        file.write(f'<path fill="none" stroke="black" stroke-width="{LINE_WIDTH}" stroke-linejoin="round" d="M')
+
+        # The path moves to the first point and then draws a line to every other point, one point per line of the file
+        command = ''
+        for chunk in chunks:
+            if len(chunk):
+                file.write(command)
+                np.savetxt(file, np.column_stack([chunk.real, -chunk.imag]), fmt='%.3f,%.3f')
+                command = 'L'
+        file.write('"/>\n</svg>\n')
+
+
+
+def png_chunk(file, chunk_type, data):
+    """
+    Writes one chunk of a PNG file: its length, type, data and the CRC-32 of the type and data
+    """
+    
+    file.write(struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+
+def rasterize(image, points, previous):
+    """
+    Draws the line through previous (the last pixel position of the chunk before, or None) and the pixel positions in points
+    onto a greyscale image, by marking the pixels at small steps along every segment.
+    Returns the last pixel position so the next chunk carries on from it
+    """
+    
+    if previous is not None:
+        points = np.concatenate([[previous], points])
+    if len(points) == 1:
+        segment_starts, steps, step_counts = points, np.zeros(1, dtype=complex), np.ones(1, dtype=np.int64)
+    else:
+        segment_starts = points[:-1]
+        steps = points[1:] - segment_starts
+        # Every segment is sampled at least every half a pixel, so no pixel along it is skipped
+        step_counts = np.ceil(np.abs(steps)*2).astype(np.int64) + 1
+
+    # Works out the position of every sample of every segment at once
+    segment_index = np.repeat(np.arange(len(segment_starts)), step_counts)
+    first_sample = np.cumsum(step_counts) - step_counts
+    fractions = (np.arange(len(segment_index)) - first_sample[segment_index]) / step_counts[segment_index]
+    samples = segment_starts[segment_index] + steps[segment_index]*fractions
+
+    # Marks the pixels under the pen, which is LINE_WIDTH pixels wide, skipping any that fall outside the image
+    height, width = image.shape
+    left = np.floor(samples.real - (LINE_WIDTH - 1)/2).astype(np.int64)
+    top = np.floor(samples.imag - (LINE_WIDTH - 1)/2).astype(np.int64)
+    for dx in range(LINE_WIDTH):
+        for dy in range(LINE_WIDTH):
+            x, y = left + dx, top + dy
+            inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+            image[y[inside], x[inside]] = 0
+    return points[-1]
+
+
+
+def export_png(path, chunks, bounds, width=800, height=550):
+    """
+    Draws the pattern onto a white greyscale image of width x height pixels, scaled to fit inside the margin,
+    and writes it to a PNG file. The points are drawn one chunk at a time, so only the image and one chunk are held in memory
+    """
+    
+    x_min, y_min, x_max, y_max = bounds
+    scale = min((width - 2*EXPORT_MARGIN)/max(x_max - x_min, 1e-9), (height - 2*EXPORT_MARGIN)/max(y_max - y_min, 1e-9))
+    # The pattern is centred in the image, with the y axis flipped so it points down like the rows of the image
+    offset_x = (width - (x_max - x_min)*scale)/2
+    offset_y = (height - (y_max - y_min)*scale)/2
+
+    image = np.full((height, width), 255, dtype=np.uint8)
+    previous = None
+    for chunk in chunks:
+        if len(chunk):
+            pixels = (chunk.real - x_min)*scale + offset_x + 1j*((y_max - chunk.imag)*scale + offset_y)
+            previous = rasterize(image, pixels, previous)
+
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        # An 8 bit greyscale image without interlacing
+        png_chunk(file, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+        # Every row starts with filter type 0 (none), and the rows are compressed and written in blocks
+        compressor = zlib.compressobj(9)
+        rows = np.concatenate([np.zeros((height, 1), dtype=np.uint8), image], axis=1)
+        for first in range(0, height, 256):
+            data = compressor.compress(rows[first:first + 256].tobytes())
+            if data:
+                png_chunk(file, b'IDAT', data)
+        png_chunk(file, b'IDAT', compressor.flush())
+        png_chunk(file, b'IEND', b'')
+
+
+
+def export_pattern(sides, length, depth, svg_path=None, png_path=None, size=(800, 550)):
+    """
+    Writes the pattern to an SVG file, a PNG file or both without opening a turtle window.
+    The points are streamed again for each file after a first pass finds the bounding box, so the pattern is never held in memory
+    """
+    
+    bounds = pattern_statistics(iter_vertex_chunks(sides, length, depth))['bounds']
+    if svg_path:
+        export_svg(svg_path, iter_vertex_chunks(sides, length, depth), bounds)
+    if png_path:
+        export_png(png_path, iter_vertex_chunks(sides, length, depth), bounds, *size)
+
+
+
 def user_input():
     """
     Prompts the user for valid values for number of sides, length of each side and the recursion depth
@@ -140,19 +458,67 @@ def turtle_Setup(length):
 
 
 
-def main():
+def parse_arguments(argv=None):
+    """
+    Reads the command line arguments, which can give the pattern and the files to export it to instead of drawing it in a window
+    """
+    
+    parser = argparse.ArgumentParser(description="Draw a recursive fractal pattern, or export it to SVG and PNG files.")
+    parser.add_argument('--sides', type=int, help="number of sides (min 3)")
+    parser.add_argument('--length', type=float, help="side length")
+    parser.add_argument('--depth', type=int, help="recursion depth (0 or greater)")
+    parser.add_argument('--svg', help="SVG file to write the pattern to instead of opening a window")
+    parser.add_argument('--png', help="PNG file to write the pattern to instead of opening a window")
+    parser.add_argument('--stats', action='store_true', help="print the number of points, total length and bounding box of the pattern")
+    parser.add_argument('--size', type=int, nargs=2, default=[800, 550], metavar=('WIDTH', 'HEIGHT'), help="size of the PNG image in pixels")
+    args = parser.parse_args(argv)
+
+    # The same checks as user_input() are made on the values given on the command line
+    if args.sides is not None and args.sides < 3:
+        parser.error("A polygon must have at least 3 sides.")
+    if args.length is not None and args.length <= 0:
+        parser.error("Length must be positive.")
+    if args.depth is not None and args.depth < 0:
+        parser.error("Depth must be 0 or greater.")
+    if min(args.size) < 1:
+        parser.error("The image size must be positive.")
+    return args
+
+
+
+def main(argv=None):
     """
     The main function that prompts the user for the inputs and calls a function to draw the pattern using those inputs
     """
     
-    # Calls a function that takes inputs from the user
-    sides, length, depth = user_input()
+    args = parse_arguments(argv)
+
+    # Uses the values from the command line, or asks the user for them if any are missing
+    if None in (args.sides, args.length, args.depth):
+        sides, length, depth = user_input()
+    else:
+        sides, length, depth = args.sides, args.length, args.depth
+
+    # Prints the statistics of the pattern, worked out while streaming its points
+    if args.stats:
+        statistics = pattern_statistics(iter_vertex_chunks(sides, length, depth))
+        x_min, y_min, x_max, y_max = statistics['bounds']
+        print(f"Points: {statistics['vertices']}, Total length: {statistics['length']:.2f}, "
+              f"Bounding box: ({x_min:.2f}, {y_min:.2f}) to ({x_max:.2f}, {y_max:.2f})")
+
+    # Writes the pattern to the files if any were given, and finishes without opening a window after either
+    if args.svg or args.png:
+        export_pattern(sides, length, depth, args.svg, args.png, args.size)
+        print(f"Pattern written to {' and '.join(path for path in (args.svg, args.png) if path)}")
+    if args.stats or args.svg or args.png:
+        return
     
-    # Calls a function to set up the turtle window
+    # Imports turtle and calls a function to set up the turtle window
+    load_turtle()
     turtle_Setup(length)              # <— pass length so setup can center correctly
 
-    # Calls a function to draw the pattern with the correct values 
-    draw_pattern(sides, length, depth)
+    # Streams the points of the pattern with the correct values and draws them on the canvas
+    draw_polyline(iter_vertex_chunks(sides, length, depth))
 
 
 